@@ -0,0 +1,124 @@
+###################################################################################################
+############ Define a bulk writer for the many small per-subject output files ####################
+# Each extracted subject produces several small files (the raw LISREL section txt, the beta/se/
+# t-value csv files and the 0/1 binary matrix txt). Instead of opening, writing and closing each
+# of them synchronously, the extraction scripts hand them to a BulkWriter, which:
+# 1) formats the matrices with vectorized NumPy (np.savetxt into an in-memory buffer), and
+# 2) writes the files from a small pool of background threads, with a bound on how many writes
+#    may be in flight at once (the caller blocks once the bound is reached, so memory stays flat).
+# Because writing happens in the background, the caller can parse the next subject while the
+# files of the previous subject are still being written.
+####################################################################################################
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+import numpy as np
+
+####################################### EDIT AS NEEDED ###################################################
+# Number of background writer threads and the maximum number of files queued/being written at once
+WRITER_THREADS = 4
+MAX_IN_FLIGHT = 32
+##########################################################################################################
+
+
+def format_matrix_csv(values, row_labels, col_labels, fmt='%.10g'):
+    """
+    Format a 2D numeric array as csv text in the same layout as DataFrame.to_csv():
+    an empty corner cell, the column labels, then one labelled row per matrix row.
+    """
+    values = np.asarray(values, dtype=float)
+    buffer = io.StringIO()
+    buffer.write(',' + ','.join(col_labels) + '\n')
+    labels = np.asarray(row_labels, dtype=object).reshape(-1, 1)
+    table = np.concatenate([labels, values.astype(object)], axis=1)
+    np.savetxt(buffer, table, fmt=['%s'] + [fmt] * values.shape[1], delimiter=',')
+    return buffer.getvalue()
+
+
+def format_binary_matrix(mask, split=18):
+    """
+    Format a 0/1 matrix in the LISREL input layout: two spaces between columns, and four spaces
+    between the lag block (first `split` columns) and the non-lag block.
+    """
+    mask = np.asarray(mask, dtype=int)
+    fmt = ['%d'] * mask.shape[1]
+    if 0 < split < mask.shape[1]:
+        fmt[split - 1] = '%d  '
+    buffer = io.StringIO()
+    np.savetxt(buffer, mask, fmt=fmt, delimiter='  ')
+    return buffer.getvalue()
+
+
+class BulkWriter:
+    """
+    Thread-backed write queue with a bounded number of in-flight writes.
+
+    Use as a context manager; leaving the block waits for all queued writes and re-raises the
+    first error encountered by a background write.
+    """
+
+    def __init__(self, threads=WRITER_THREADS, max_in_flight=MAX_IN_FLIGHT):
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write(self, path, formatter, args, encoding):
+        try:
+            text = formatter(*args) if formatter else args[0]
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding=encoding) as outfile:
+                outfile.write(text)
+        finally:
+            self._slots.release()
+
+    def _submit(self, path, formatter, args, encoding='utf-8'):
+        # Blocks the caller while MAX_IN_FLIGHT writes are already queued
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._write, path, formatter, args, encoding)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Drop futures that already finished cleanly so the list stays short
+        self._futures = [f for f in self._futures if not f.done() or f.exception()]
+        self._futures.append(future)
+        return future
+
+    def write_text(self, path, text, encoding='utf-8'):
+        """Queue a plain text file."""
+        return self._submit(path, None, (text,), encoding)
+
+    def write_matrix_csv(self, path, values, row_labels, col_labels):
+        """Queue a labelled numeric matrix as a csv file."""
+        return self._submit(path, format_matrix_csv, (values, row_labels, col_labels))
+
+    def write_binary_matrix(self, path, mask, split=18):
+        """Queue a 0/1 matrix in the LISREL input txt layout."""
+        return self._submit(path, format_binary_matrix, (mask, split))
+
+    def wait(self):
+        """Wait for the writes queued so far (the writer stays open), then re-raise the first failure (if any)."""
+        wait_futures(list(self._futures))
+        self._raise_first_error()
+
+    def close(self):
+        """Wait for all queued writes, then re-raise the first failure (if any)."""
+        self._pool.shutdown(wait=True)
+        self._raise_first_error()
+
+    def _raise_first_error(self):
+        for future in self._futures:
+            error = future.exception()
+            if error is not None:
+                raise error
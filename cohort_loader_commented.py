@@ -0,0 +1,200 @@
+###################################################################################################
+########### Define a lazy, importable view of a cohort for interactive (notebook) analysis ########
+# Opening a Cohort does no file I/O at all; a subject is parsed only when one of its attributes is
+# first accessed, and parsed subjects are kept in a bounded LRU cache (CACHE_SIZE subjects), so
+# memory stays bounded while browsing a large cohort:
+#
+#   from cohort_loader_commented import Cohort
+#   cohort = Cohort(extracted_folder="Extracted", lisrel_folder="LiseralOutput")
+#   cohort["10005"].beta     # lhs ROI x rhs label DataFrame, NaN where no path is estimated
+#   cohort["10005"].se, cohort["10005"].tval
+#   cohort["10005"].fit      # fit statistics, criteria, excellent (and the QC flags of #####_fit.csv)
+#   cohort["10005"].psi      # PSI estimates; .matrices has every extracted matrix with SE and t values
+#   cohort.edges()           # all estimated paths as an EdgeList (see edge_list_commented.py)
+#   cohort.path_summary()    # per-path counts, mean and SD of beta over the cohort
+#
+# Subjects are read from the LISERAL output txt files (lisrel_folder/o#####.txt) when available,
+# which also gives the fit statistics, otherwise from the extracted csv files
+# (extracted_folder/#####/#####_beta.csv, _se.csv and _tval.csv, and the fit statistics of
+# #####_fit.csv when the AM extractor wrote one). Both folders may also be zip/tar
+# archives ("archive.zip" or "archive.zip::folder") and the files .gz/.bz2/.xz compressed; zip
+# archives are preferred for browsing, since tar archives have no index for random access.
+####################################################################################################
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from compressed_io_commented import file_name, join, list_files, list_subfolders, open_text, resolve
+from edge_list_commented import EDGE_LIST_FILENAME, EdgeList, read_edges
+from gimme_model_commented import GimmeModel
+from liseral_AM_extract_commented import read_fit_csv
+from lisrel_output_parser_commented import MATRICES, extract_am_output, extract_number_and_text
+from roi_registry_commented import get_registry
+
+####################################### EDIT AS NEEDED ###################################################
+# Maximum number of parsed subjects kept in memory
+CACHE_SIZE = 256
+##########################################################################################################
+
+
+class Subject:
+    """
+    Handle to one subject of a Cohort; nothing is parsed until an attribute is accessed.
+    """
+
+    def __init__(self, cohort, subject_id):
+        self._cohort = cohort
+        self.subject_id = subject_id
+
+    def __repr__(self):
+        return f"Subject({self.subject_id!r})"
+
+    @property
+    def model(self):
+        """Single-subject GimmeModel (see gimme_model_commented.py)."""
+        return self._cohort._load(self.subject_id)[0]
+
+    @property
+    def beta(self):
+        return self._frame(self.model.beta[0])
+
+    @property
+    def se(self):
+        return self._frame(self.model.se[0])
+
+    @property
+    def tval(self):
+        return self._frame(self.model.tval[0])
+
+    @property
+    def fit(self):
+        """
+        Fit statistics of the selected model; read from the extracted #####_fit.csv (with the QC
+        flags) for a subject read from the extracted csv files, or None when there is none.
+        """
+        return self._cohort._load(self.subject_id)[1]
+
+    @property
+    def matrices(self):
+        """
+        {name: LisrelMatrix} of all matrices extracted from the LISERAL output (see MATRICES in
+        lisrel_output_parser_commented.py), or None when read from the extracted csv files.
+        """
+        return self._cohort._load(self.subject_id)[2]
+
+    @property
+    def psi(self):
+        """PSI estimates (all VAR rows and columns), or None when not available."""
+        matrices = self.matrices
+        if not matrices or 'PSI' not in matrices:
+            return None
+        registry = self.model.registry
+        return pd.DataFrame(matrices['PSI'].estimate, index=registry.var_names, columns=registry.var_names, copy=False)
+
+    def _frame(self, values):
+        registry = self.model.registry
+        return pd.DataFrame(values, index=registry.rois, columns=registry.labels, copy=False)
+
+
+class Cohort:
+    """
+    Lazy mapping of subject ID -> Subject over a LISERAL output folder and/or an extracted folder.
+    """
+
+    def __init__(self, extracted_folder=None, lisrel_folder=None, cache_size=CACHE_SIZE, matrices=MATRICES):
+        if extracted_folder is None and lisrel_folder is None:
+            raise ValueError("give an extracted_folder and/or a lisrel_folder")
+        self.extracted_folder = extracted_folder
+        self.lisrel_folder = lisrel_folder
+        self.cache_size = cache_size
+        self.matrices = tuple(dict.fromkeys(('BETA',) + tuple(matrices)))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = None
+
+    def __getitem__(self, subject_id):
+        subject_id = str(subject_id)
+        if self._lisrel_path(subject_id) is None and self._beta_path(subject_id) is None:
+            raise KeyError(subject_id)
+        return Subject(self, subject_id)
+
+    def __contains__(self, subject_id):
+        return str(subject_id) in self.subject_ids()
+
+    def __iter__(self):
+        return iter(self.subject_ids())
+
+    def __len__(self):
+        return len(self.subject_ids())
+
+    def subject_ids(self):
+        """Sorted subject IDs found in the folders (listed once, on first use)."""
+        if self._ids is None:
+            ids = set()
+            if self.lisrel_folder is not None:
+                for path in list_files(self.lisrel_folder, "o*.txt"):
+                    participant_id, _ = extract_number_and_text(file_name(path))
+                    if participant_id is not None:
+                        ids.add(participant_id)
+            if self.extracted_folder is not None:
+                ids.update(list_subfolders(self.extracted_folder))
+            self._ids = sorted(ids)
+        return self._ids
+
+    def edges(self):
+        """
+        EdgeList of all subjects: read straight from the cohort edge list of the extracted folder
+        when there is one, otherwise collected subject by subject.
+        """
+        if self.extracted_folder is not None:
+            edges_path = resolve(join(self.extracted_folder, EDGE_LIST_FILENAME))
+            if edges_path is not None:
+                return read_edges(edges_path)
+        return EdgeList.concatenate(EdgeList.from_model(self[sid].model) for sid in self.subject_ids())
+
+    def path_summary(self):
+        """Per-path cohort aggregation (EdgeList.path_summary)."""
+        return self.edges().path_summary()
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _lisrel_path(self, subject_id):
+        if self.lisrel_folder is None:
+            return None
+        return resolve(join(self.lisrel_folder, f"o{subject_id}.txt"))
+
+    def _beta_path(self, subject_id):
+        if self.extracted_folder is None:
+            return None
+        return resolve(join(self.extracted_folder, subject_id, f"{subject_id}_beta.csv"))
+
+    def _load(self, subject_id):
+        # LRU cache of (GimmeModel, fit, {name: LisrelMatrix}) per subject
+        with self._lock:
+            if subject_id in self._cache:
+                self._cache.move_to_end(subject_id)
+                return self._cache[subject_id]
+
+        lisrel_path = self._lisrel_path(subject_id)
+        if lisrel_path is not None:
+            # One read gives BETA, the other configured matrices and the fit statistics
+            with open_text(lisrel_path, encoding='ISO-8859-1') as file:
+                _, matrices, fit = extract_am_output(file.readlines(), lisrel_path, self.matrices, get_registry().n_vars, verbose=False)
+            if 'BETA' not in matrices:
+                raise ValueError(f"no BETA estimates in the LISERAL output of {subject_id}: {lisrel_path}")
+            entry = (GimmeModel.from_lisrel_beta({subject_id: matrices['BETA']}), fit, matrices)
+        else:
+            fit_path = resolve(join(self.extracted_folder, subject_id, f"{subject_id}_fit.csv"))
+            fit = read_fit_csv(fit_path) if fit_path is not None else None
+            entry = (GimmeModel.from_beta_csv({subject_id: self._beta_path(subject_id)}), fit, None)
+
+        with self._lock:
+            self._cache[subject_id] = entry
+            self._cache.move_to_end(subject_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
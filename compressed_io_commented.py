@@ -0,0 +1,352 @@
+###################################################################################################
+########### Define streaming readers for compressed LISERAL and R GIMME output files #############
+# Archived outputs can be read in place, without decompressing them to scratch disk first:
+# 1) single compressed files: o10005.txt.gz, 10005_beta.csv.bz2, ...Betas.csv.xz (gzip, bz2, xz);
+# 2) members of zip and tar archives (tar, tar.gz, tar.bz2, tar.xz), addressed as
+#    "archive.zip::folder/o10005.txt" (ARCHIVE_SEPARATOR between the archive and the member).
+# A plain path is also accepted everywhere, and resolve() finds "o10005.txt" when only
+# "o10005.txt.gz" (or .bz2/.xz) exists.
+#
+# iter_texts() reads a whole cohort (a folder or an archive) in a background thread that
+# decompresses the next files while the caller parses the current one (bounded read-ahead).
+# The thread stops as soon as the caller stops iterating (break, exception or closing the generator).
+#
+# A file opened from an archive member closes the archive with it, so use it in a "with" block.
+####################################################################################################
+
+import bz2
+import contextlib
+import fnmatch
+import gzip
+import io
+import lzma
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from functools import lru_cache
+from pathlib import Path
+
+####################################### EDIT AS NEEDED ###################################################
+# Number of decompressed files kept ready ahead of the parser
+PREFETCH = 8
+# Seconds between checks whether the caller of iter_texts() has stopped, while the read-ahead is full
+STOP_POLL_INTERVAL = 0.1
+##########################################################################################################
+
+ARCHIVE_SEPARATOR = '::'
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def strip_compression(name):
+    """File name without a .gz/.bz2/.xz suffix."""
+    root, ext = os.path.splitext(name)
+    return root if ext in COMPRESSED_OPENERS else name
+
+
+def file_name(path):
+    """Base name of a file or archive member path, without a .gz/.bz2/.xz suffix."""
+    return os.path.basename(strip_compression(str(path).split(ARCHIVE_SEPARATOR)[-1]))
+
+
+def is_archive(path):
+    return str(path).endswith(TAR_SUFFIXES) or str(path).endswith('.zip')
+
+
+def open_text(path, encoding='utf-8'):
+    """
+    Open a plain file, a gzip/bz2/xz compressed file or an archive member for streaming text reading.
+    """
+    path = str(path)
+    if ARCHIVE_SEPARATOR in path:
+        return io.TextIOWrapper(open_binary(path), encoding=encoding)
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1])
+    if opener is not None:
+        return opener(path, 'rt', encoding=encoding)
+    return open(path, 'r', encoding=encoding)
+
+
+def open_binary(path):
+    """Binary counterpart of open_text()."""
+    path = str(path)
+    if ARCHIVE_SEPARATOR in path:
+        archive, member = path.split(ARCHIVE_SEPARATOR, 1)
+        return _open_member(archive, member, path)
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1])
+    if opener is not None:
+        return opener(path, 'rb')
+    return open(path, 'rb')
+
+
+def _open_member(archive, member, path):
+    # Open an archive member; the returned stream closes the member's decompressor and the archive
+    with contextlib.ExitStack() as stack:
+        if archive.endswith('.zip'):
+            zf = stack.enter_context(zipfile.ZipFile(archive))
+            try:
+                raw = stack.enter_context(zf.open(member))
+            except KeyError:
+                raise FileNotFoundError(path) from None
+        else:
+            # Look the member up in the cached index: extractfile(name) would scan every member
+            # header (decompressing the whole archive) on each open
+            info = _archive_index(archive)[3].get(_member_name(member))
+            if info is None:
+                raise FileNotFoundError(path)
+            raw = stack.enter_context(stack.enter_context(tarfile.open(archive)).extractfile(info))
+        # Members may themselves be compressed
+        opener = COMPRESSED_OPENERS.get(os.path.splitext(member)[1])
+        stream = raw if opener is None else stack.enter_context(opener(raw))
+        return _ArchiveMemberReader(stream, stack.pop_all())
+
+
+class _ArchiveMemberReader(io.BufferedIOBase):
+    """Read-only stream of an archive member that closes everything it was opened with."""
+
+    def __init__(self, stream, resources):
+        super().__init__()
+        self._stream = stream
+        self._resources = resources
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def read1(self, size=-1):
+        return self._stream.read(size)
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._resources.close()
+            finally:
+                super().close()
+
+
+def modified_time(path):
+    """Modification time of a file; archive members have the modification time of their archive."""
+    return os.path.getmtime(str(path).split(ARCHIVE_SEPARATOR, 1)[0])
+
+
+def join(folder, *names):
+    """os.path.join that also addresses members when `folder` is a zip or tar archive."""
+    folder = str(folder)
+    if ARCHIVE_SEPARATOR not in folder and is_archive(folder) and os.path.isfile(folder):
+        return folder + ARCHIVE_SEPARATOR + '/'.join(names)
+    return os.path.join(folder, *names)
+
+
+def resolve(path):
+    """
+    Return the path (or compressed variant path.gz/.bz2/.xz) that exists, or None.
+    Archive members are checked against the archive's member list.
+    """
+    path = str(path)
+    candidates = [path] + [path + suffix for suffix in COMPRESSED_OPENERS]
+    if ARCHIVE_SEPARATOR in path:
+        archive, _ = path.split(ARCHIVE_SEPARATOR, 1)
+        members = _member_set(archive)
+        return next((c for c in candidates if c.split(ARCHIVE_SEPARATOR, 1)[1] in members), None)
+    return next((c for c in candidates if os.path.isfile(c)), None)
+
+
+def list_files(root, pattern='*'):
+    """
+    Sorted paths of all files under a folder or inside an archive (root "archive.zip" or
+    "archive.zip::folder") whose path relative to `root` matches `pattern` (glob-like: '*' does not
+    cross folders, compression suffix ignored), e.g. list_files(root, "*/individual/*.csv").
+    """
+    root = str(root)
+    archive, prefix = _split_root(root)
+    if archive is not None:
+        return [f"{archive}{ARCHIVE_SEPARATOR}{m}" for m in _archive_members(archive)
+                if _member_matches(m, prefix, pattern)]
+    if '/' not in pattern:
+        # Only the top level of the folder can match
+        return sorted(os.path.join(root, entry.name) for entry in os.scandir(root)
+                      if entry.is_file() and fnmatch.fnmatch(strip_compression(entry.name), pattern))
+    paths = []
+    for folder, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            if _path_matches(strip_compression(relative), pattern):
+                paths.append(path)
+    return sorted(paths)
+
+
+def _split_root(root):
+    # (archive, member prefix) for "archive.zip" or "archive.zip::folder" roots, (None, None) for folders
+    if ARCHIVE_SEPARATOR in root:
+        archive, folder = root.split(ARCHIVE_SEPARATOR, 1)
+        return archive, folder.strip('/') + '/' if folder.strip('/') else ''
+    if is_archive(root) and os.path.isfile(root):
+        return root, ''
+    return None, None
+
+
+def list_folders(root, pattern='*'):
+    """
+    Sorted paths of the folders under a folder or inside an archive whose path relative to `root`
+    matches `pattern` (like Path.glob), e.g. list_folders(root, "*/individual"). Archive folders
+    are returned as "archive.zip::folder" roots that list_files() accepts.
+    """
+    root = str(root)
+    archive, prefix = _split_root(root)
+    if archive is None:
+        return sorted(str(path) for path in Path(root).glob(pattern) if path.is_dir())
+    return [f"{archive}{ARCHIVE_SEPARATOR}{folder}" for folder in _archive_index(archive)[1]
+            if folder.startswith(prefix) and _path_matches(folder[len(prefix):], pattern)]
+
+
+def _path_matches(relative, pattern):
+    # fnmatch with glob semantics: the pattern and the path must have the same number of parts
+    return relative.count('/') == pattern.count('/') and fnmatch.fnmatch(relative, pattern)
+
+
+def _member_matches(member, prefix, pattern):
+    return member.startswith(prefix) and _path_matches(strip_compression(member[len(prefix):]), pattern)
+
+
+def _member_set(archive):
+    return _archive_index(archive)[2]
+
+
+def list_subfolders(root):
+    """Sorted names of the immediate subfolders of a folder or of an archive (root)."""
+    root = str(root)
+    archive, prefix = _split_root(root)
+    if archive is None:
+        return sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    return sorted({f[len(prefix):].split('/', 1)[0] for f in _archive_index(archive)[1]
+                   if f.startswith(prefix)})
+
+
+def _archive_members(archive):
+    return _archive_index(archive)[0]
+
+
+def _archive_index(archive):
+    # (files, folders, file set, {file: TarInfo} of a tar archive) of an archive, cached per archive
+    # (and modification time) for the whole run
+    stat = os.stat(archive)
+    return _cached_index(archive, stat.st_mtime, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def _cached_index(archive, mtime, size):
+    tar_members = {}
+    if archive.endswith('.zip'):
+        with zipfile.ZipFile(archive) as zf:
+            entries = [(info.filename, info.is_dir()) for info in zf.infolist()]
+    else:
+        with tarfile.open(archive) as tar:
+            entries = [(member.name, member.isdir()) for member in tar.getmembers()
+                       if member.isfile() or member.isdir()]
+            # Headers of the files, so members are opened without scanning the archive again
+            tar_members = {_member_name(member.name): member for member in tar.getmembers() if member.isfile()}
+    files, folders = [], set()
+    for name, is_dir in entries:
+        name = _member_name(name)
+        if not name:
+            continue
+        if is_dir:
+            folders.add(name)
+        else:
+            files.append(name)
+        # Every parent of a member is a folder, even without its own archive entry
+        parts = name.split('/')
+        folders.update('/'.join(parts[:i]) for i in range(1, len(parts)))
+    return tuple(sorted(files)), tuple(sorted(folders)), frozenset(files), tar_members
+
+
+def _member_name(name):
+    # Archive member name relative to the archive root ("./a/b/" -> "a/b")
+    name = name.rstrip('/')
+    while name.startswith('./'):
+        name = name[2:]
+    return '' if name == '.' else name
+
+
+def iter_texts(root, pattern='*', encoding='utf-8', prefetch=PREFETCH, select=None):
+    """
+    Yield (path, lines) for every file of list_files(root, pattern). Files are read and
+    decompressed by a background thread, at most `prefetch` files ahead of the caller.
+    Tar archives are streamed once from start to end instead of seeking to each member.
+    Only paths for which `select(path)` is true are read, when a `select` function is given.
+    The background thread stops, and closes the files it reads, when the caller stops iterating.
+    """
+    items = queue.Queue(maxsize=prefetch)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # Wait for room in the read-ahead; False once the caller has stopped iterating
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=STOP_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            root_str = str(root)
+            archive, prefix = _split_root(root_str)
+            if archive is not None and archive.endswith(TAR_SUFFIXES):
+                with tarfile.open(archive, mode='r|*') as tar:
+                    for member in tar:
+                        if stop.is_set():
+                            return
+                        name = _member_name(member.name)
+                        path = f"{archive}{ARCHIVE_SEPARATOR}{name}"
+                        if (member.isfile() and _member_matches(name, prefix, pattern)
+                                and (select is None or select(path))):
+                            # Stream members cannot seek, so read the raw bytes before decoding
+                            data = tar.extractfile(member).read()
+                            opener = COMPRESSED_OPENERS.get(os.path.splitext(name)[1])
+                            if opener is not None:
+                                data = opener(io.BytesIO(data)).read()
+                            # Universal newlines, as for every other input (LISERAL outputs have CRLF endings)
+                            lines = io.TextIOWrapper(io.BytesIO(data), encoding=encoding).readlines()
+                            if not put((path, lines)):
+                                return
+            else:
+                for path in list_files(root_str, pattern):
+                    if stop.is_set():
+                        return
+                    if select is not None and not select(path):
+                        continue
+                    with open_text(path, encoding) as file:
+                        lines = file.readlines()
+                    if not put((path, lines)):
+                        return
+        except BaseException as error:
+            put(error)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # Runs on break, on an exception in the caller and when the generator is closed or collected
+        stop.set()
+        producer.join()
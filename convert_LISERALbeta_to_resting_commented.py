@@ -9,64 +9,50 @@
 # 'lhs', 'rhs', 'beta', 'level' (group or ind)
 # Note, the way ff_id is extracted assumes the original complex filename contains 'csm14aff' 
 # followed by the five-digit ID.
+#
+# When the folder has a cohort edge list (EDGE_LIST_FILENAME, written by the extractors, see
+# edge_list_commented.py) of exactly the subject folders with a beta file, and it is newer than
+# all of those beta files, the rows are built straight from its records instead of reading and
+# melting one dense beta csv per subject. Otherwise (e.g. subjects extracted after the edge list
+# was written, or beta files rewritten since) the beta csv files are read.
+#
+# For multi-node runs, use --shard i/N to convert one shard of the subjects per node and
+# --merge N to combine the partial outputs into OUTPUT_FILENAME (see sharding_commented.py)
 ####################################################################################################
 
+import argparse
+import io
+
+import numpy as np
 import pandas as pd
-import os
-import sys
 
-####################################### EDIT AS NEEDED ###################################################
-# Mapping of VAR codes to descriptive names of the ROIs - should match those used in R GIMME
-
-MAPPING = {
-    'VAR1': 'DMN_1lag', 'VAR2': 'DMN_2lag', 'VAR3': 'DMN_3lag', 'VAR4': 'DMN_4lag', 'VAR5': 'DMN_5lag', 'VAR6': 'DMN_6lag',
-    'VAR7': 'SAL_1lag', 'VAR8': 'SAL_2lag', 'VAR9': 'SAL_3lag', 'VAR10': 'SAL_4lag', 'VAR11': 'SAL_5lag', 'VAR12': 'SAL_6lag',
-    'VAR13': 'FPN_1lag', 'VAR14': 'FPN_2lag', 'VAR15': 'FPN_3lag', 'VAR16': 'FPN_4lag', 'VAR17': 'FPN_5lag', 'VAR18': 'FPN_6lag',
-    'VAR19': 'DMN_1', 'VAR20': 'DMN_2', 'VAR21': 'DMN_3', 'VAR22': 'DMN_4', 'VAR23': 'DMN_5', 'VAR24': 'DMN_6',
-    'VAR25': 'SAL_1', 'VAR26': 'SAL_2', 'VAR27': 'SAL_3', 'VAR28': 'SAL_4', 'VAR29': 'SAL_5', 'VAR30': 'SAL_6',
-    'VAR31': 'FPN_1', 'VAR32': 'FPN_2', 'VAR33': 'FPN_3', 'VAR34': 'FPN_4', 'VAR35': 'FPN_5', 'VAR36': 'FPN_6'
-}
-##########################################################################################################
+from compressed_io_commented import join, list_subfolders, modified_time, open_text, resolve
+from edge_list_commented import EDGE_LIST_FILENAME, read_edges
+from gimme_model_commented import GimmeModel
+from sharding_commented import add_shard_arguments, in_shard, partial_path, partial_paths, write_atomic
 
 ####################################### EDIT AS NEEDED ###################################################
 # Specify output filename
 OUTPUT_FILENAME = "GIMME_r_format_output.csv"
+# Subject IDs converted by a shard (partial output only, needed to merge the reference rows)
+PROCESSED_IDS_FILENAME = "GIMME_r_format_processed_ids.txt"
 ##########################################################################################################
 
-def process_beta_file(beta_path: str, file_id: str, group_pairs: set) -> pd.DataFrame:
+def process_beta_file(beta_path: str, file_id: str, group: np.ndarray) -> pd.DataFrame:
     """
     Process a single beta CSV, return a DataFrame with columns [file, lhs, rhs, beta, level].
+    group is the n x 2n group-level path mask of the reference (see gimme_model_commented.py).
     """
-    df = pd.read_csv(beta_path, index_col=0)
-    df.index.name = 'lhs'
-
-    long_df = (
-        df.reset_index()
-          .melt(id_vars='lhs', var_name='rhs', value_name='beta')
-          .query('beta != 0')
-    )
-
-    # Clean and map VAR codes
-    for col in ['lhs', 'rhs']:
-        long_df[col] = (
-            long_df[col].astype(str)
-                      .str.replace(r'\s+', '', regex=True)
-                      .map(MAPPING)
-        )
-
-    long_df['file'] = file_id
+    model = GimmeModel.from_beta_csv({file_id: beta_path}, with_se=False)
     # Assign level based on reference group pairs
-    long_df['level'] = long_df.apply(
-        lambda row: 'group' if (row['lhs'], row['rhs']) in group_pairs else 'ind',
-        axis=1
-    )
-
-    return long_df[['file', 'lhs', 'rhs', 'beta', 'level']]
+    model.group = group
+    return model.to_r_frame()[['file', 'lhs', 'rhs', 'beta', 'level']]
 
 
-def main(root_dir: str, reference_path: str) -> None:
+def main(root_dir: str, reference_path: str, shard=None, merge=None) -> None:
     # Load reference file
-    ref_df = pd.read_csv(reference_path)
+    with open_text(reference_path) as file:
+        ref_df = pd.read_csv(file)
 
     # Extract participant ID (five digits after 'csm14aff')
     ref_df['id'] = ref_df['file'].astype(str).str.extract(r'csm14aff(\d{5})')
@@ -74,9 +60,7 @@ def main(root_dir: str, reference_path: str) -> None:
     # Prepare group-level pairs from reference
     ref_df['lhs'] = ref_df['lhs'].astype(str).str.strip()
     ref_df['rhs'] = ref_df['rhs'].astype(str).str.strip()
-    group_pairs = set(
-        tuple(x) for x in ref_df.loc[ref_df['level'] == 'group', ['lhs', 'rhs']].values
-    )
+    group = GimmeModel.from_r_frame(ref_df.loc[ref_df['level'] == 'group']).group
 
     # Map each ID to its original complex file name
     id_to_complex = {
@@ -84,32 +68,125 @@ def main(root_dir: str, reference_path: str) -> None:
         for id_val in ref_df['id'].dropna().unique()
     }
 
+    if merge:
+        # Converted rows and IDs of all shards, in the subject order of a single-node run
+        beta_df, processed_ids = read_partial_outputs(merge)
+        print(f"Merging {merge} shards")
+    else:
+        beta_df, processed_ids = convert_subjects(root_dir, group, id_to_complex, shard)
+        if shard is not None:
+            write_partial_outputs(beta_df, processed_ids, shard)
+            return
+
+    if beta_df is None:
+        print("No beta files processed. Exiting.")
+        return
+
+    write_combined_output(ref_df, beta_df, processed_ids)
+
+
+def convert_edge_list(edge_list, group, id_to_complex, shard=None):
+    """
+    Convert the subjects (of this shard) of a cohort EdgeList and return (rows with the
+    original complex file names, or None if there are none, processed IDs).
+    """
+    # Same subject order as the subdirectories, and the same rows as the dense beta files (beta != 0)
+    processed_ids = sorted({sid for sid in edge_list.subject_ids if in_shard(sid, shard)})
+    beta_df = edge_list.select(processed_ids).to_r_frame(group)
+    beta_df = beta_df.loc[beta_df['beta'] != 0, ['file', 'lhs', 'rhs', 'beta', 'level']].reset_index(drop=True)
+    if beta_df.empty:
+        return None, set(processed_ids)
+
+    beta_df['file'] = beta_df['file'].astype(int)
+    # Replace with original complex filenames
+    beta_df['file'] = beta_df['file'].astype(str).map(id_to_complex)
+    return beta_df, set(processed_ids)
+
+
+def convert_subjects(root_dir, group, id_to_complex, shard=None):
+    """
+    Convert the beta file of every participant subdirectory (of this shard) and return
+    (rows with the original complex file names, or None if there are none, processed IDs).
+    """
+    # Beta file of every participant subdirectory (of a folder or a zip/tar archive), None if missing
+    beta_paths = {}
+    for entry in list_subfolders(root_dir):
+        # The beta file may also be .gz/.bz2/.xz compressed
+        beta_paths[entry] = resolve(join(root_dir, entry, f"{entry}_beta.csv"))
+
+    edges_path = resolve(join(root_dir, EDGE_LIST_FILENAME))
+    if edges_path is not None:
+        edge_list = read_edges(edges_path)
+        # The edge list is only used when it has exactly the subjects of the beta files and no beta
+        # file was written after it (e.g. by GimmeModel.write_beta_csv or by hand)
+        beta_ids = {entry for entry, path in beta_paths.items() if path is not None}
+        if set(edge_list.subject_ids) != beta_ids:
+            print(f"Warning: the subjects of {edges_path} differ from the subject folders, reading the beta files instead")
+        elif any(modified_time(beta_paths[sid]) > modified_time(edges_path) for sid in beta_ids):
+            print(f"Warning: some beta files are newer than {edges_path}, reading the beta files instead")
+        else:
+            print(f"Reading the cohort edge list {edges_path}")
+            return convert_edge_list(edge_list, group, id_to_complex, shard)
+
     processed_ids = set()
     all_dfs = []
 
     # Iterate through participant subdirectories
-    for entry in os.listdir(root_dir):
-        subdir = os.path.join(root_dir, entry)
-        if os.path.isdir(subdir):
-            beta_file = f"{entry}_beta.csv"
-            beta_path = os.path.join(subdir, beta_file)
-            if os.path.isfile(beta_path):
-                processed_ids.add(entry)
-                df_out = process_beta_file(beta_path, entry, group_pairs)
-                all_dfs.append(df_out)
-            else:
-                print(f"Warning: missing beta file for {entry}: {beta_path}")
+    for entry, found_path in beta_paths.items():
+        if not in_shard(entry, shard):
+            continue
+        if found_path is not None:
+            processed_ids.add(entry)
+            df_out = process_beta_file(found_path, entry, group)
+            all_dfs.append(df_out)
+        else:
+            print(f"Warning: missing beta file for {entry}: {join(root_dir, entry, f'{entry}_beta.csv')}")
 
     if not all_dfs:
-        print("No beta files processed. Exiting.")
-        return
+        return None, processed_ids
 
     # Compile beta outputs
     beta_df = pd.concat(all_dfs, ignore_index=True)
     beta_df['file'] = beta_df['file'].astype(int)
     # Replace with original complex filenames
     beta_df['file'] = beta_df['file'].astype(str).map(id_to_complex)
+    return beta_df, processed_ids
+
+
+def write_partial_outputs(beta_df, processed_ids, shard):
+    """Write the converted rows and the processed IDs of one shard."""
+    if beta_df is None:
+        beta_df = pd.DataFrame(columns=['file', 'lhs', 'rhs', 'beta', 'level'])
+    write_atomic(partial_path(OUTPUT_FILENAME, shard), beta_df.to_csv(index=False))
+    write_atomic(partial_path(PROCESSED_IDS_FILENAME, shard), ''.join(f"{i}\n" for i in sorted(processed_ids)))
+    print(f"Saved shard {shard[0]} of {shard[1]} ({len(processed_ids)} subjects) to {partial_path(OUTPUT_FILENAME, shard)}")
+
 
+def read_partial_outputs(count):
+    """
+    Read the partial outputs of `count` shards and return (rows, processed IDs) in the order a
+    single-node run converts them (by subject directory name), or (None, IDs) if there are no rows.
+    """
+    processed_ids = set()
+    for path in partial_paths(PROCESSED_IDS_FILENAME, count):
+        with open(path, 'r', encoding='utf-8') as file:
+            processed_ids.update(line.strip() for line in file if line.strip())
+
+    frames = []
+    for path in partial_paths(OUTPUT_FILENAME, count):
+        with open(path, 'r', encoding='utf-8') as file:
+            frames.append(pd.read_csv(io.StringIO(file.read()), dtype={'file': object, 'lhs': object, 'rhs': object, 'level': object}))
+    beta_df = pd.concat(frames, ignore_index=True)
+    if beta_df.empty:
+        return None, processed_ids
+    # Stable sort on the subject directory name (the five digits of the file name)
+    order = beta_df['file'].astype(str).str.extract(r'csm14aff(\d{5})', expand=False)
+    beta_df = beta_df.iloc[np.argsort(order.to_numpy(dtype=str), kind='stable')].reset_index(drop=True)
+    return beta_df, processed_ids
+
+
+def write_combined_output(ref_df, beta_df, processed_ids):
+    """Combine the converted rows with the reference rows of unprocessed IDs and save OUTPUT_FILENAME."""
     # Keep reference rows for IDs not processed
     ref_keep = ref_df.loc[~ref_df['id'].isin(processed_ids), ['file', 'lhs', 'rhs', 'beta', 'level']].copy()
 
@@ -135,8 +212,9 @@ def main(root_dir: str, reference_path: str) -> None:
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <root_folder> <reference_csv>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Convert extracted LISERAL beta files to the R GIMME output format")
+    parser.add_argument('root_folder')
+    parser.add_argument('reference_csv')
+    args = add_shard_arguments(parser).parse_args()
 
-    main(sys.argv[1], sys.argv[2])
+    main(args.root_folder, args.reference_csv, shard=args.shard, merge=args.merge)
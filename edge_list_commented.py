@@ -0,0 +1,337 @@
+###################################################################################################
+############ Define a sparse edge-list (COO) format for cohort path estimates ####################
+# Most entries of the n x 2n beta matrices are absent paths, so a cohort is stored as one record per
+# estimated path instead of one dense csv per subject:
+#   subject  uint32   index into the subject ID list
+#   lhs      uint16   label code of the lhs ROI (contemporaneous, n .. 2n-1; see roi_registry_commented.py)
+#   rhs      uint16   label code of the rhs label (lagged 0 .. n-1, contemporaneous n .. 2n-1)
+#   beta, se, tval    float32 (se / tval are NaN when not available)
+#
+# A cohort edge list is two files that are only ever appended to, in bulk:
+#   cohort_edges.bin            the records, little-endian, with no header (EDGE_DTYPE)
+#   cohort_edges.subjects.txt   one subject ID per line; line i is subject index i
+# so its size and load time scale with the number of estimated paths, and subjects without any
+# estimated path are still listed. Records are ordered by subject, then rhs, then lhs, i.e. the row
+# order of the R GIMME long format, which therefore comes straight from the records:
+#
+#   with EdgeListWriter("Extracted/cohort_edges.bin") as edges:
+#       edges.add("10005", beta, se, tval)               # n x 2n arrays, NaN where no path
+#   with EdgeListWriter("Extracted/cohort_edges.bin", update=True) as edges:
+#       edges.add("10005", beta, se, tval)               # replaces the records of subject 10005
+#   cohort = read_edges("Extracted/cohort_edges.bin")
+#   cohort.to_r_frame(group)                             # R GIMME long format
+#   cohort.path_summary()                                # per-path cohort aggregation
+####################################################################################################
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from compressed_io_commented import ARCHIVE_SEPARATOR, COMPRESSED_OPENERS, open_binary, open_text, resolve, strip_compression
+from gimme_model_commented import BETA, SE, TVAL, GimmeModel
+from roi_registry_commented import get_registry
+from sharding_commented import write_atomic
+
+####################################### EDIT AS NEEDED ###################################################
+# Name of the cohort edge list saved next to the extracted subject folders
+EDGE_LIST_FILENAME = "cohort_edges.bin"
+# Number of buffered records after which an EdgeListWriter appends them to disk
+BUFFER_EDGES = 1 << 16
+##########################################################################################################
+
+EDGE_DTYPE = np.dtype([('subject', '<u4'), ('lhs', '<u2'), ('rhs', '<u2'),
+                       ('beta', '<f4'), ('se', '<f4'), ('tval', '<f4')])
+ESTIMATE_FIELDS = ((BETA, 'beta'), (SE, 'se'), (TVAL, 'tval'))
+
+
+def subjects_path(path):
+    """Path of the subject ID list of an edge list file."""
+    return os.path.splitext(strip_compression(str(path)))[0] + '.subjects.txt'
+
+
+def widen(values):
+    """
+    float32 -> float64 through the shortest decimal representation, so values parsed from LISERAL
+    text (a few decimals) come back exactly as written, e.g. 0.23 and not 0.2300000041723251.
+    """
+    return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64)
+
+
+def subject_edges(subject_index, beta, se=None, tval=None, n_rois=None):
+    """
+    Records of one subject from n x 2n arrays (lhs ROI rows, NaN where no path is estimated),
+    ordered by rhs, then lhs.
+    """
+    n = beta.shape[0] if n_rois is None else n_rois
+    cols, rows = np.nonzero(~np.isnan(beta).T)
+    edges = np.empty(len(rows), dtype=EDGE_DTYPE)
+    edges['subject'] = subject_index
+    edges['lhs'] = rows + n
+    edges['rhs'] = cols
+    for name, values in (('beta', beta), ('se', se), ('tval', tval)):
+        edges[name] = np.nan if values is None else values[rows, cols]
+    return edges
+
+
+class EdgeList:
+    """
+    Edge-list records of a set of subjects (see the header of this file for the layout).
+    """
+
+    def __init__(self, subject_ids, edges=None, registry=None):
+        self.registry = registry or get_registry()
+        self.subject_ids = [str(s) for s in subject_ids]
+        self.edges = np.empty(0, dtype=EDGE_DTYPE) if edges is None else edges
+
+    def __len__(self):
+        return len(self.edges)
+
+    @classmethod
+    def from_model(cls, model):
+        """Records of every path in the mask of a GimmeModel."""
+        subjects, cols, rows = np.nonzero(model.mask.transpose(0, 2, 1))
+        edges = np.empty(len(rows), dtype=EDGE_DTYPE)
+        edges['subject'] = subjects
+        edges['lhs'] = rows + model.registry.n_rois
+        edges['rhs'] = cols
+        for k, name in ESTIMATE_FIELDS:
+            edges[name] = model.estimates[k, subjects, rows, cols]
+        return cls(model.subject_ids, edges, model.registry)
+
+    def to_model(self):
+        """Dense GimmeModel of the same subjects."""
+        model = GimmeModel(self.subject_ids, registry=self.registry)
+        subjects = self.edges['subject']
+        rows = self.registry.code_roi[self.edges['lhs']]
+        cols = self.edges['rhs']
+        model.mask[subjects, rows, cols] = 1
+        for k, name in ESTIMATE_FIELDS:
+            model.estimates[k, subjects, rows, cols] = widen(self.edges[name])
+        return model
+
+    def select(self, subject_ids):
+        """Edge list of the given subjects only (in the given order, renumbered from 0)."""
+        positions = {sid: i for i, sid in enumerate(self.subject_ids)}
+        return self.take([positions[str(sid)] for sid in subject_ids])
+
+    def take(self, positions):
+        """Edge list of the subjects at the given positions (in that order, renumbered from 0)."""
+        positions = np.asarray(positions, dtype=np.intp)
+        new_index = np.full(len(self.subject_ids) + 1, -1, dtype=np.int64)
+        new_index[positions] = np.arange(len(positions))
+        edges = self.edges[new_index[self.edges['subject']] >= 0]
+        edges['subject'] = new_index[edges['subject']]
+        # Keep the subject, rhs, lhs order of the records
+        edges = edges[np.argsort(edges['subject'], kind='stable')]
+        return EdgeList([self.subject_ids[i] for i in positions], edges, self.registry)
+
+    @classmethod
+    def concatenate(cls, edge_lists):
+        """One edge list of the subjects of several edge lists, in the given order."""
+        edge_lists = list(edge_lists)
+        subject_ids, chunks = [], []
+        for edge_list in edge_lists:
+            chunk = edge_list.edges.copy()
+            chunk['subject'] += len(subject_ids)
+            chunks.append(chunk)
+            subject_ids.extend(edge_list.subject_ids)
+        registry = edge_lists[0].registry if edge_lists else None
+        return cls(subject_ids, np.concatenate(chunks) if chunks else None, registry)
+
+    def to_r_frame(self, group=None):
+        """
+        R GIMME long format, one row per record (same columns and order as GimmeModel.to_r_frame).
+        group is an optional n x 2n group-level path mask.
+        """
+        registry = self.registry
+        rows = registry.code_roi[self.edges['lhs']]
+        cols = self.edges['rhs'].astype(np.intp)
+        is_group = np.zeros(len(rows), dtype=bool) if group is None else np.asarray(group, dtype=bool)[rows, cols]
+        return pd.DataFrame({
+            'file': np.asarray(self.subject_ids, dtype=object)[self.edges['subject']],
+            'lhs': registry.rois[rows],
+            'op': '~',
+            'rhs': registry.labels[cols],
+            'beta': widen(self.edges['beta']),
+            'se': widen(self.edges['se']),
+            'z': widen(self.edges['tval']),
+            'level': np.where(is_group, 'group', 'ind'),
+        })
+
+    def path_summary(self):
+        """
+        Cohort aggregation per path (ordered by rhs, then lhs): number and proportion of subjects
+        with the path estimated, mean and standard deviation of its beta.
+        """
+        registry = self.registry
+        n = registry.n_rois
+        key = self.edges['rhs'].astype(np.intp) * n + registry.code_roi[self.edges['lhs']]
+        beta = widen(self.edges['beta'])
+        size = n * registry.n_vars
+        count = np.bincount(key, minlength=size)
+        total = np.bincount(key, weights=beta, minlength=size)
+        squares = np.bincount(key, weights=beta ** 2, minlength=size)
+        present = np.nonzero(count)[0]
+        count, total, squares = count[present], total[present], squares[present]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            sd = np.sqrt(np.maximum(squares - count * mean ** 2, 0) / (count - 1))
+        return pd.DataFrame({
+            'lhs': registry.rois[present % n],
+            'rhs': registry.labels[present // n],
+            'n_subjects': count,
+            'proportion': count / max(len(self.subject_ids), 1),
+            'mean_beta': mean,
+            'sd_beta': np.where(count > 1, sd, np.nan),
+        })
+
+
+class EdgeListWriter:
+    """
+    Buffered writer of an edge list file: records are appended to disk in bulk, every
+    buffer_edges records and on close. With append=False an existing edge list is replaced.
+    With update=True the added subjects replace their own records in an existing edge list and
+    all other subjects are kept (re-extracting some subjects); the edge list is then rewritten
+    on close, under temporary names that are renamed into place.
+    """
+
+    def __init__(self, path, append=False, buffer_edges=BUFFER_EDGES, registry=None, update=False):
+        self.path = str(path)
+        self.registry = registry or get_registry()
+        self.buffer_edges = buffer_edges
+        self.update = update
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if update:
+            exists = os.path.isfile(self.path) and os.path.isfile(subjects_path(self.path))
+            self._existing = read_edges(self.path, self.registry) if exists else EdgeList([], registry=self.registry)
+            self.n_subjects = 0
+        elif append and os.path.isfile(subjects_path(self.path)):
+            with open(subjects_path(self.path), 'r', encoding='utf-8') as file:
+                self.n_subjects = sum(1 for line in file if line.strip())
+            self._drop_unlisted()
+        else:
+            open(self.path, 'wb').close()
+            open(subjects_path(self.path), 'w', encoding='utf-8').close()
+            self.n_subjects = 0
+        self._chunks = []
+        self._ids = []
+        self._buffered = 0
+
+    def _drop_unlisted(self):
+        # Truncate records of subjects whose IDs were never written (an interrupted flush)
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        if size < EDGE_DTYPE.itemsize:
+            return
+        existing = np.memmap(self.path, dtype=EDGE_DTYPE, mode='r', shape=(size // EDGE_DTYPE.itemsize,))
+        keep = int(np.searchsorted(existing['subject'], self.n_subjects))
+        del existing
+        if keep * EDGE_DTYPE.itemsize != size:
+            os.truncate(self.path, keep * EDGE_DTYPE.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, subject_id, beta, se=None, tval=None):
+        """Add one subject from n x 2n arrays (lhs ROI rows, NaN where no path is estimated)."""
+        edges = subject_edges(self.n_subjects + len(self._ids), beta, se, tval, self.registry.n_rois)
+        self._queue([subject_id], edges)
+
+    def add_edge_list(self, edge_list):
+        """Add all subjects of an EdgeList."""
+        edges = edge_list.edges.copy()
+        edges['subject'] += self.n_subjects + len(self._ids)
+        self._queue(edge_list.subject_ids, edges)
+
+    def _queue(self, subject_ids, edges):
+        self._ids.extend(str(s) for s in subject_ids)
+        self._chunks.append(edges)
+        self._buffered += len(edges)
+        if self._buffered >= self.buffer_edges and not self.update:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered records, then their subject IDs (a reader ignores records of unlisted subjects)."""
+        if not self._ids:
+            return
+        with open(self.path, 'ab') as file:
+            np.concatenate(self._chunks).tofile(file)
+        with open(subjects_path(self.path), 'a', encoding='utf-8') as file:
+            file.write(''.join(f"{sid}\n" for sid in self._ids))
+        self.n_subjects += len(self._ids)
+        self._chunks, self._ids, self._buffered = [], [], 0
+
+    def close(self):
+        if self.update:
+            self._rewrite()
+        else:
+            self.flush()
+        # Stamp the edge list when it is complete: the converter only uses an edge list that is newer
+        # than the beta files, which are written before it is closed
+        os.utime(self.path)
+
+    def _rewrite(self):
+        # Existing subjects keep their position (with the new records when added again), new ones follow
+        added = EdgeList(self._ids, np.concatenate(self._chunks) if self._chunks else None, self.registry)
+        combined = EdgeList.concatenate([self._existing, added])
+        latest = {sid: i for i, sid in enumerate(combined.subject_ids)}
+        edge_list = combined.take([latest[sid] for sid in dict.fromkeys(combined.subject_ids)])
+        write_edge_list(self.path, edge_list)
+        self._existing = edge_list
+        self._chunks, self._ids, self._buffered = [], [], 0
+
+
+def write_edge_list(path, edge_list):
+    """Write an EdgeList to an edge list file, under temporary names that are renamed into place."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    edge_list.edges.tofile(tmp_path)
+    os.replace(tmp_path, path)
+    write_atomic(subjects_path(path), ''.join(f"{sid}\n" for sid in edge_list.subject_ids))
+
+
+def sort_edge_list(path):
+    """
+    Order the subjects of an edge list file by ID, as merge_edge_lists does, so a single-node run
+    gives the same file as a merged one whatever order the subjects were read in (e.g. the member
+    order of a tar archive). The file is only rewritten when it is not in that order yet.
+    """
+    edge_list = read_edges(path)
+    order = np.argsort(np.asarray(edge_list.subject_ids, dtype=str), kind='stable')
+    if (order != np.arange(len(order))).any():
+        write_edge_list(path, edge_list.take(order))
+
+
+def merge_edge_lists(paths, output_path):
+    """
+    Combine edge list files (e.g. the partial outputs of shards) into one, with the subjects
+    ordered by ID as in a single-node run (see sort_edge_list).
+    """
+    combined = EdgeList.concatenate(read_edges(path) for path in paths)
+    order = np.argsort(np.asarray(combined.subject_ids, dtype=str), kind='stable')
+    with EdgeListWriter(output_path) as writer:
+        writer.add_edge_list(combined.take(order))
+    return len(combined.subject_ids)
+
+
+def read_edges(path, registry=None):
+    """
+    Read an edge list file (plain, compressed or archive member, see compressed_io_commented.py).
+    """
+    path = str(path)
+    with open_text(resolve(subjects_path(path)) or subjects_path(path)) as file:
+        subject_ids = [line.strip() for line in file if line.strip()]
+    found = resolve(path) or path
+    if ARCHIVE_SEPARATOR in found or os.path.splitext(found)[1] in COMPRESSED_OPENERS:
+        with open_binary(found) as file:
+            data = file.read()
+        edges = np.frombuffer(data, dtype=EDGE_DTYPE, count=len(data) // EDGE_DTYPE.itemsize).copy()
+    else:
+        edges = np.fromfile(found, dtype=EDGE_DTYPE)
+    # Records appended without their subject IDs (an interrupted flush) are ignored
+    edges = edges[edges['subject'] < len(subject_ids)]
+    return EdgeList(subject_ids, edges, registry)
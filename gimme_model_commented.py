@@ -0,0 +1,215 @@
+###################################################################################################
+######## Define an in-memory GIMME model shared by the R GIMME and LISERAL formats ###############
+# A GimmeModel holds, for every subject, the 0/1 path mask and the beta/se/t value estimates in
+# one set of stacked NumPy arrays laid out exactly like a LISERAL input matrix:
+#   mask       subjects x n x 2n   (rows: lhs ROI, columns: lag block then non-lag block)
+#   estimates  3 x subjects x n x 2n   (beta, se, t value; NaN where no path is estimated)
+#   group      n x 2n   (paths estimated at the group level)
+# where n is the number of ROIs in roi_registry_commented.py and the column index is the label
+# code (VAR number - 1). Each format is a zero-copy view of these arrays, and each has a reader
+# and a writer, so a refit loop can go R -> LISERAL -> R without re-reading intermediate files.
+# All readers also accept compressed files and archive members (see compressed_io_commented.py):
+#
+#   model = GimmeModel.from_r_csv("paths.csv")              # R GIMME csv (file, lhs, op, rhs, ...)
+#   model.write_lisrel_matrices("InputMatrix/{sid}_matrix.txt", writer)   # LISERAL 0/1 input matrices
+#   ... run LISERAL ...
+#   refit = GimmeModel.from_lisrel_outputs({"10005": "o10005.txt"})   # parsed once, in memory
+#   refit.to_r_frame().to_csv("refit_paths.csv", index=False)         # back to R long format
+####################################################################################################
+
+import numpy as np
+import pandas as pd
+
+from bulk_output_writer_commented import format_binary_matrix
+from compressed_io_commented import open_text, resolve, strip_compression
+from lisrel_output_parser_commented import select_am_section, parse_beta_matrices
+from roi_registry_commented import get_registry
+
+BETA, SE, TVAL = 0, 1, 2
+
+
+class GimmeModel:
+    """
+    Path masks and estimates for a set of subjects (see the header of this file for the layout).
+    """
+
+    def __init__(self, subject_ids, mask=None, estimates=None, group=None, registry=None):
+        self.registry = registry or get_registry()
+        n, n_vars = self.registry.n_rois, self.registry.n_vars
+        self.subject_ids = [str(s) for s in subject_ids]
+        self._positions = {sid: i for i, sid in enumerate(self.subject_ids)}
+        shape = (len(self.subject_ids), n, n_vars)
+        self.mask = np.zeros(shape, dtype=np.int8) if mask is None else mask
+        self.estimates = np.full((3,) + shape, np.nan) if estimates is None else estimates
+        self.group = np.zeros((n, n_vars), dtype=bool) if group is None else group
+
+    def __len__(self):
+        return len(self.subject_ids)
+
+    def __getitem__(self, subject_id):
+        """Zero-copy sub-model of one subject."""
+        i = self._positions[str(subject_id)]
+        return GimmeModel([subject_id], self.mask[i:i + 1], self.estimates[:, i:i + 1], self.group, self.registry)
+
+    # Zero-copy views
+    @property
+    def beta(self):
+        return self.estimates[BETA]
+
+    @property
+    def se(self):
+        return self.estimates[SE]
+
+    @property
+    def tval(self):
+        return self.estimates[TVAL]
+
+    @property
+    def lag_mask(self):
+        return self.mask[:, :, :self.registry.n_rois]
+
+    @property
+    def contemporaneous_mask(self):
+        return self.mask[:, :, self.registry.n_rois:]
+
+    ############################## R GIMME long format ##############################
+
+    @classmethod
+    def from_r_frame(cls, df, subject_col='file', registry=None, subject_ids=None):
+        """
+        Build a model from an R GIMME path table (columns: file, lhs, rhs, beta, se, z, level).
+        Optional columns that are missing are left as NaN / individual level.
+        subject_ids optionally gives the model's subjects (in that order), so that subjects
+        without any row in the table are kept with an empty mask.
+        Raises KeyError for unknown labels and for lagged labels on the lhs.
+        """
+        registry = registry or get_registry()
+        if subject_ids is None:
+            codes, subject_ids = pd.factorize(df[subject_col].astype(str), sort=True)
+        else:
+            subject_ids = list(dict.fromkeys(str(s) for s in subject_ids))
+            codes = pd.Categorical(df[subject_col].astype(str), categories=subject_ids).codes.astype(np.intp)
+            if (codes < 0).any():
+                raise KeyError(f"subjects not in subject_ids: {sorted(set(df[subject_col].astype(str)[codes < 0]))}")
+        model = cls(subject_ids, registry=registry)
+        rows = registry.encode_lhs(df['lhs'])
+        cols = registry.encode(df['rhs'])
+        model.mask[codes, rows, cols] = 1
+        for k, column in ((BETA, 'beta'), (SE, 'se'), (TVAL, 'z')):
+            if column in df:
+                model.estimates[k, codes, rows, cols] = pd.to_numeric(df[column], errors='coerce').to_numpy()
+        if 'level' in df:
+            is_group = (df['level'].astype(str) == 'group').to_numpy()
+            model.group[rows[is_group], cols[is_group]] = True
+        return model
+
+    @classmethod
+    def from_r_csv(cls, path, subject_col='file', registry=None):
+        with open_text(path) as file:
+            return cls.from_r_frame(pd.read_csv(file), subject_col, registry)
+
+    def to_r_frame(self):
+        """
+        R GIMME long format, one row per estimated path, ordered by subject, then rhs, then lhs.
+        Columns: file, lhs, op, rhs, beta, se, z, level.
+        """
+        registry = self.registry
+        # Transpose so np.nonzero walks rhs-major within each subject
+        subjects, cols, rows = np.nonzero(self.mask.transpose(0, 2, 1))
+        values = self.estimates[:, subjects, rows, cols]
+        return pd.DataFrame({
+            'file': np.asarray(self.subject_ids, dtype=object)[subjects],
+            'lhs': registry.rois[rows],
+            'op': '~',
+            'rhs': registry.labels[cols],
+            'beta': values[BETA],
+            'se': values[SE],
+            'z': values[TVAL],
+            'level': np.where(self.group[rows, cols], 'group', 'ind'),
+        })
+
+    ############################## LISERAL 0/1 input matrices ##############################
+
+    def to_lisrel_matrix(self, subject_id):
+        """LISERAL input matrix txt of one subject (lag matrix row followed by non-lag matrix row)."""
+        return format_binary_matrix(self.mask[self._positions[str(subject_id)]], split=self.registry.n_rois)
+
+    def write_lisrel_matrices(self, path_template, writer):
+        """
+        Queue the LISERAL input matrix of every subject on a BulkWriter, path_template is
+        formatted with the subject id, e.g. "InputMatrix/{sid}_matrix.txt".
+        """
+        for i, sid in enumerate(self.subject_ids):
+            writer.write_binary_matrix(path_template.format(sid=sid), self.mask[i], split=self.registry.n_rois)
+
+    @classmethod
+    def from_lisrel_matrices(cls, paths, registry=None):
+        """Build a model (mask only) from LISERAL input matrix txt files, given {subject_id: path}."""
+        model = cls(list(paths), registry=registry)
+        for i, path in enumerate(paths.values()):
+            with open_text(path) as file:
+                model.mask[i] = np.loadtxt(file, dtype=np.int8, ndmin=2)
+        return model
+
+    ############################## LISERAL output txt files ##############################
+
+    @classmethod
+    def from_lisrel_beta(cls, betas, registry=None):
+        """
+        Build a model from parsed LISERAL BETA matrices, given {subject_id: (beta, se, tval)} of
+        full 2n x 2n arrays (e.g. the 'BETA' LisrelMatrix of lisrel_output_parser_commented.py).
+        """
+        model = cls(list(betas), registry=registry)
+        n = model.registry.n_rois
+        for i, matrices in enumerate(betas.values()):
+            # Keep the non-lagged (lhs) rows only
+            model.estimates[:, i] = np.stack(matrices)[:, n:]
+        model.mask[:] = ~np.isnan(model.beta)
+        return model
+
+    @classmethod
+    def from_lisrel_text(cls, texts, registry=None):
+        """Build a model from extracted LISERAL model sections, given {subject_id: raw text}."""
+        n_vars = (registry or get_registry()).n_vars
+        return cls.from_lisrel_beta({sid: parse_beta_matrices(raw_text, n_vars) for sid, raw_text in texts.items()}, registry)
+
+    @classmethod
+    def from_lisrel_outputs(cls, paths, registry=None):
+        """Build a model from (automatic search) LISERAL output files, given {subject_id: path}."""
+        texts = {}
+        for sid, path in paths.items():
+            with open_text(path, encoding='ISO-8859-1') as file:
+                texts[sid] = ''.join(select_am_section(file.readlines(), path))
+        return cls.from_lisrel_text(texts, registry)
+
+    ############################## Extracted beta/se/t value csv files ##############################
+
+    def write_beta_csv(self, folder, writer):
+        """Queue the {id}_beta.csv, {id}_se.csv and {id}_tval.csv files of every subject on a BulkWriter."""
+        var_names = self.registry.var_names
+        row_names = var_names[self.registry.n_rois:]
+        for i, sid in enumerate(self.subject_ids):
+            for k, name in ((BETA, 'beta'), (SE, 'se'), (TVAL, 'tval')):
+                writer.write_matrix_csv(f"{folder}/{sid}/{sid}_{name}.csv", np.nan_to_num(self.estimates[k, i]), row_names, var_names)
+
+    @classmethod
+    def from_beta_csv(cls, paths, with_se=True, registry=None):
+        """
+        Build a model from extracted csv files, given {subject_id: beta csv path}. With with_se,
+        the matching _se.csv and _tval.csv files are read when they exist next to the beta file.
+        """
+        model = cls(list(paths), registry=registry)
+        for i, beta_path in enumerate(paths.values()):
+            for k, name in ((BETA, 'beta'), (SE, 'se'), (TVAL, 'tval')):
+                path = beta_path if k == BETA else resolve(strip_compression(beta_path)[:-len('_beta.csv')] + f"_{name}.csv")
+                if k != BETA and (not with_se or path is None):
+                    continue
+                with open_text(path) as file:
+                    df = pd.read_csv(file, index_col=0)
+                rows = model.registry.code_roi[model.registry.encode_vars(df.index)]
+                cols = model.registry.encode_vars(df.columns)
+                model.estimates[k, i][np.ix_(rows, cols)] = df.to_numpy(dtype=float)
+        # Absent paths are stored as 0 in the csv files
+        model.mask[:] = np.nan_to_num(model.beta) != 0
+        model.estimates[:, model.mask == 0] = np.nan
+        return model
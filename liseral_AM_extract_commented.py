@@ -17,236 +17,199 @@
 # 4) a csv file of the t values of betas, excluding lagged rows; 
 # 5) a txt file of the LISERAL model in the 1/0 format to be inputted into the next LISERAL model 
 # for further refitting
+# 6) csv files of the extra matrices in EXTRA_OUTPUTS (e.g., PSI and the squared multiple
+# correlations) with their standard errors and t values, captured in the same read of the output;
+# 7) a csv file of the fit statistics of the extracted model, with the |value| > 1 beta/psi QC flags
+# 8) a cohort table (COHORT_FIT_FILENAME in save_path) with the fit row of every subject
+# 9) the cohort edge list (EDGE_LIST_FILENAME in save_path, see edge_list_commented.py): one
+# record per estimated path with its beta, standard error and t value, appended in bulk
+# Matrices that are not printed in the extracted model are skipped (no csv files, empty QC flag).
+# The matrix sizes and VAR labels come from the ROI registry (see roi_registry_commented.py).
+#
+# For multi-node runs, use --shard i/N to process one shard of the subjects per node and
+# --merge N to combine the partial cohort tables (see sharding_commented.py)
 ####################################################################################################
 
-import re
+import argparse
 import numpy as np
-import pandas as pd
 import os
 
-def extract_lisrel_section(file_path, output_file):
-    with open(file_path, 'r', encoding='ISO-8859-1') as file:
-        lines = file.readlines()
-    
-    extract = False
-    section = []
-    last_lisrel_index = None
-    rmsea_value = None
-    nnfi_value = None
-    cfi_value = None
-    srmr_value = None
-    should_break = False
-    
-    for i, line in enumerate(lines):
-        if "LISREL Estimates (Maximum Likelihood)" in line:
-            last_lisrel_index = i
-        
-        if "Goodness of Fit Statistics" in line:
-            for j in range(i + 1, len(lines)):
-                if "LISREL Estimates (Maximum Likelihood)" in lines[j]:
-                    break  # Stop iterating when the next "LISREL Estimates (Maximum Likelihood)" is found
-                if "Root Mean Square Error of Approximation (RMSEA)" in lines[j]:
-                    rmsea_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
-                    rmsea_value = float(rmsea_value)
-                if "Non-Normed Fit Index (NNFI)" in lines[j]:
-                    nnfi_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
-                    nnfi_value = float(nnfi_value)
-                if "Comparative Fit Index (CFI)" in lines[j]:
-                    cfi_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
-                    cfi_value = float(cfi_value)
-                if "Standardized RMR" in lines[j]:
-                    srmr_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
-                    srmr_value = float(srmr_value)
-
-                criteria = 0
-                if rmsea_value and rmsea_value <= 0.05:
-                    criteria += 1
-                if nnfi_value and nnfi_value >= 0.95:
-                    criteria += 1
-                if cfi_value and cfi_value >= 0.95:
-                    criteria += 1
-                if srmr_value and srmr_value <= 0.05:
-                    criteria += 1
-
-                if criteria >= 2:
-                    should_break = True
-                    print("We found a model with excellent fit for participant=", file_path, " criteria=", criteria, " rmsea=", rmsea_value, " nnfi=", nnfi_value, " cfi=", cfi_value, " srmr=", srmr_value, " model starts on line=", last_lisrel_index)
-                    break
-            
-            if should_break:
-                break
-    if not should_break:
-        print("We did not find a model with excellent fit for participant=", file_path, " criteria=", criteria, " rmsea=", rmsea_value, " nnfi=", nnfi_value, " cfi=", cfi_value, " srmr=", srmr_value, " extracted the final model starting on line=", last_lisrel_index)
-
-    if last_lisrel_index is not None:
-        section = []
-        for j in range(last_lisrel_index + 1, len(lines)):
-            if "Covariance Matrix of ETA" in lines[j]:
-                break
-            section.append(lines[j])
-    
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        for line in section:
-            outfile.write(line)
-
-# Function to extract subID, expects that file name starts with "o", followed by subID
-def extract_number_and_text(filename):
-    match = re.match(r"o(\d{5})([a-zA-Z]*)\.txt", filename)
-    if match:
-        return match.group(1), match.group(2)
-    return None, None
-
-# Function to strip white spaces and parentheses due to LISERAL output formatting
-def parse_token(token):
+from bulk_output_writer_commented import BulkWriter
+from compressed_io_commented import file_name, iter_texts, open_text
+from edge_list_commented import EDGE_LIST_FILENAME, EdgeListWriter, merge_edge_lists, sort_edge_list
+from lisrel_output_parser_commented import extract_am_output, extract_number_and_text, MATRICES
+from roi_registry_commented import get_registry
+from sharding_commented import add_shard_arguments, in_shard, partial_path, partial_paths, write_atomic
+
+################################ MODIFY HERE ####################################
+# Extra matrices/sections saved next to the beta files (see MATRICES in lisrel_output_parser_commented.py),
+# as {id}_{name}.csv, {id}_{name}_se.csv and {id}_{name}_tval.csv
+EXTRA_OUTPUTS = {'PSI': 'psi', 'Squared Multiple Correlations for Structural Equations': 'smc'}
+# Cohort table of the fit rows of all subjects, saved in save_path
+COHORT_FIT_FILENAME = "cohort_fit.csv"
+COHORT_FIT_COLUMNS = ['participant_id', 'rmsea', 'nnfi', 'cfi', 'srmr', 'criteria', 'excellent', 'bad_beta', 'bad_psi']
+#################################################################################
+
+def extract_lisrel_section(file_path, output_file, writer=None, matrices=MATRICES, lines=None):
+    """
+    Read a LISERAL output once (plain, compressed or archive member, unless its `lines` are
+    given), save the selected model section to output_file and return ({name: LisrelMatrix}, fit)
+    for all configured matrices of that model.
+    """
+    if lines is None:
+        with open_text(file_path, encoding='ISO-8859-1') as file:
+            lines = file.readlines()
+
+    section, results, fit = extract_am_output(lines, file_path, matrices, n_vars=len(var_names))
+
+    # Hand the section to the bulk writer if one is given, so the caller can keep parsing
+    raw_text = ''.join(section)
+    if writer is not None:
+        writer.write_text(output_file, raw_text)
+    else:
+        with open(output_file, 'w', encoding='utf-8') as outfile:
+            outfile.write(raw_text)
+    return results, fit
+
+# Create row and column labels ("VAR 1" ... "VAR 2n" for n ROIs); csv files exclude the first n (lagged) rows
+registry = get_registry()
+n_rois = registry.n_rois
+var_names = list(registry.var_names)
+row_names = var_names[n_rois:]
+
+def write_matrix_files(writer, subject_dir, participant_id, results):
+    """
+    Queue the beta/se/t value csv files and the EXTRA_OUTPUTS csv files of one subject.
+    """
+    # Drop the first n (lagged) rows; NaN (no path) is written as 0
+    if 'BETA' in results:
+        for suffix, values in zip(('beta', 'se', 'tval'), results['BETA']):
+            writer.write_matrix_csv(f"{subject_dir}/{participant_id}_{suffix}.csv", np.nan_to_num(values[n_rois:]), row_names, var_names)
+
+    for name, short_name in EXTRA_OUTPUTS.items():
+        if name not in results:
+            continue
+        matrix = results[name]
+        # Square matrices drop the first n (lagged) rows like BETA; single-row sections are kept as is
+        square = matrix.estimate.shape[0] == len(var_names)
+        labels, start = (row_names, n_rois) if square else ([short_name], 0)
+        for suffix, values in (('', matrix.estimate), ('_se', matrix.se), ('_tval', matrix.tval)):
+            values = values[start:]
+            if suffix and np.isnan(values).all():
+                continue
+            writer.write_matrix_csv(f"{subject_dir}/{participant_id}_{short_name}{suffix}.csv", np.nan_to_num(values), labels, var_names)
+
+def write_extracted_files(writer, subject_dir, participant_id, results, fit):
+    """
+    Queue all extracted files of one subject: write_matrix_files, the 0/1 input matrix and a
+    fit csv (fit statistics plus the |value| > 1 beta/psi QC, left empty for a matrix that was
+    not extracted). Returns that fit dict.
     """
-    Remove surrounding whitespace and parentheses.
-    Convert the token to a float if possible; otherwise, return np.nan.
+    write_matrix_files(writer, subject_dir, participant_id, results)
+
+    # Same QC as search_indSEM_betapsi_commented.py: any |value| > 1 (betas excluding lagged columns)
+    fit = dict(fit, bad_beta=None, bad_psi=None)
+    if 'BETA' in results:
+        # Create 0/1 input matrix
+        beta = results['BETA'].estimate[n_rois:]
+        writer.write_binary_matrix(f"{subject_dir}/{participant_id}_extractedAM_matrix.txt", ~np.isnan(beta))
+        fit['bad_beta'] = bool((np.abs(np.nan_to_num(beta[:, n_rois:])) > 1).any())
+    if 'PSI' in results:
+        fit['bad_psi'] = bool((np.abs(np.nan_to_num(results['PSI'].estimate)) > 1).any())
+    writer.write_text(f"{subject_dir}/{participant_id}_fit.csv",
+                      ','.join(fit) + '\n' + ','.join('' if v is None else str(v) for v in fit.values()) + '\n')
+    return fit
+
+def read_fit_csv(path):
     """
-    token = token.strip()
-    if token in ['- -', '--', '']:
-        return np.nan
-    token = token.strip("()")
+    Read a fit csv written by write_extracted_files back into a fit dict (empty values are None,
+    True/False are booleans, other values numbers).
+    """
+    with open_text(path) as file:
+        names, values = (line.rstrip('\n').split(',') for line in file.readlines()[:2])
+    return {name: _fit_value(value) for name, value in zip(names, values)}
+
+def _fit_value(text):
+    if text == '':
+        return None
+    if text in ('True', 'False'):
+        return text == 'True'
     try:
-        return float(token)
+        return int(text)
     except ValueError:
-        return np.nan
+        return float(text)
+
+def cohort_fit_row(participant_id, fit):
+    """One line of the cohort fit table (COHORT_FIT_COLUMNS)."""
+    values = dict(fit, participant_id=participant_id)
+    return ','.join('' if values.get(c) is None else str(values[c]) for c in COHORT_FIT_COLUMNS)
+
+def write_cohort_fit(path, rows):
+    """Write the cohort fit table, ordered by participant ID whichever order the rows came in."""
+    rows = sorted(rows, key=lambda row: row.split(',', 1)[0])
+    write_atomic(path, '\n'.join([','.join(COHORT_FIT_COLUMNS)] + rows) + '\n')
+
+def merge_cohort_fit(path, count):
+    """Combine the partial cohort fit tables of `count` shards into the table of a single-node run."""
+    rows = []
+    for partial in partial_paths(path, count):
+        with open(partial, 'r', encoding='utf-8') as file:
+            rows.extend(line for line in file.read().splitlines()[1:] if line)
+    write_cohort_fit(path, rows)
+    print(f"Merged {count} shards into {path}")
 
 ################################ MODIFY HERE ####################################
 ############# Switch to location of YOUR liseral output file ####################
+# (a folder or a zip/tar archive; output files may be .gz/.bz2/.xz compressed)
 folder_path = "/Users/Insert/Your/Liseral/Output/File/Path/Here"
+######Switch to location where you want the extracted files to be saved #########
+save_path = "/Users/Insert/Your/Preferred/Saving/Location/Path/Here"
 #################################################################################
 
-# Iterate through all items in the folder
-for item_name in os.listdir(folder_path):
-    item_path = os.path.join(folder_path, item_name)
-    
-    if item_path.endswith(".txt") and os.path.isfile(item_path):
-        # Process file
-        print(f"File: {item_path}")
-
-        # Example usage
-        input_path = item_path
-        subfile_name = item_path.split("/")[-1]
-        participant_id, participant_suffix = extract_number_and_text(subfile_name)
-        ################################ MODIFY HERE ####################################
-        ############# Switch to location of YOUR liseral output file ####################
-        os.makedirs(f"/Users/Insert/Your/Liseral/Output/File/Path/Here/{participant_id}", exist_ok=True)
-        output_path = f"/Users/Insert/Your/Liseral/Output/File/Path/Here/{participant_id}/{participant_id}_replace_with_your_file_name.txt"
-        #################################################################################
-        extract_lisrel_section(input_path, output_path)
-
-        ###### Here begins key function of extracting information from LISERAL formatted models ######
-        
-        # Read the content of the file.
-        with open(output_path, 'r') as file:
-            raw_text = file.read()
-
-        # Create an empty 36x36 matrix that will hold a triple for each cell.
-        matrix = np.empty((36, 36), dtype=object)
-        # Initialize each cell with a default triple.
-        for i in range(36):
-            for j in range(36):
-                matrix[i, j] = (np.nan, np.nan, np.nan)
-
-        # Split the text into blocks using "BETA" as a delimiter.
-        blocks = re.split(r'\n\s*BETA\s*\n', raw_text)[1:]
-
-        # Process each block.
-        for block in blocks:
-            lines = block.splitlines()
-            # Find the first nonempty line which should be the header.
-            header_line = next((line for line in lines if line.strip()), None)
-            if header_line is None:
-                continue
-            # Extract column variable names (e.g., "VAR 1", "VAR 2", …)
-            col_names = re.findall(r'VAR\s+\d+', header_line)
-            
-            # Use a while-loop with an index so we can look ahead.
-            i = lines.index(header_line) + 1  # start after the header
-
-            while i < len(lines):
-                line = lines[i]
-                # print("@@@@@@@@@@@@@@ahh", line)
-                increment = 0
-                # Check if the line starts with a row label (e.g., "VAR 19")
-                if re.match(r'^\s*VAR\s+\d+', line):
-                    # This is the first line of a row group.
-                    tokens1 = re.split(r'\s{2,}', line.strip())
-                    row_label = tokens1[0]  # e.g., "VAR 19"
-                    row_num = int(re.search(r'\d+', row_label).group()) - 1
-                    vals1 = tokens1[1:]
-                    vals2 = []
-                    vals3 = []
-                    if not all(x == "- -" for x in vals1):
-                        # Try to get the next line as the second part of the triple.
-                        if i + 1 < len(lines):
-                            tokens2 = re.split(r'\s{2,}', lines[i+1].strip())
-                            vals2 = tokens2
-                            # increment += 1
-                            # print("VALS", row_num, tokens2)
-                            # i += 1  # skip this line as it's been processed
-                        # Try to get the next line as the third part of the triple.
-                        if i + 2 < len(lines):
-                            tokens3 = re.split(r'\s{2,}', lines[i+2].strip())
-                            # print(tokens3)
-                            # print("TOKESNS", tokens3)
-                            vals3 = tokens3
-                            # increment += 1
-                            # i += 1  # skip this line as well
-                    
-                    # For each column, assign a triple value. vals1 is always sparse and vals2 and vals3 are dense arrays.
-                    for j in range(len(vals1)):
-                        if j >= len(col_names):
-                            continue
-                        col_label = col_names[j]
-                        col_num = int(re.search(r'\d+', col_label).group()) - 1
-                        # Parse each of the tokens for the three values.
-                        v1 = parse_token(vals1[j])
-                        v2 = np.nan
-                        v3 = np.nan
-                        if not v1 is np.nan and vals2 and vals3:
-                            v2 = vals2.pop(0)
-                            # remove the left and right paren which are always there
-                            v2 = v2[1:-1]
-                            v3 = vals3.pop(0)
-                        matrix[row_num, col_num] = (v1, v2, v3)
-                        
-                i += 1 # move to the next line
-
-        # Create row and column labels ("VAR 1" ... "VAR 36")
-        var_names = [f"VAR {i}" for i in range(1, 37)]
-        df = pd.DataFrame(matrix, index=var_names, columns=var_names)
-
-        # Extract the first, second, and third values from each tuple.
-        first_values = df.applymap(lambda x: x[0] if isinstance(x, tuple) else x)
-        second_values = df.applymap(lambda x: x[1] if isinstance(x, tuple) else x)
-        third_values = df.applymap(lambda x: x[2] if isinstance(x, tuple) else x)
-
-        # Drop the first 18 rows
-        first_values = first_values.iloc[18:]
-        second_values = second_values.iloc[18:]
-        third_values = third_values.iloc[18:]
-
-        # Create 0/1 input matrix
-        bin_matrix = first_values.copy()
-        bin_matrix = bin_matrix.astype(float)
-        bin_matrix = bin_matrix.applymap(lambda x: 1 if not pd.isna(x) else 0)
-        bin_matrix = bin_matrix.astype(int)
-
-        # Replace all NaN values with 0
-        first_values = first_values.fillna(0)
-        second_values = second_values.fillna(0)
-        third_values = third_values.fillna(0)
-
-        # Write each to a separate CSV file.
-        ################################ MODIFY HERE ####################################
-        ######Switch to location where you want the extracted files to be saved #########
-        first_values.to_csv(f"/Users/Insert/Your/Preferred/Saving/Location/Path/Here/{participant_id}/{participant_id}_beta.csv")
-        second_values.to_csv(f"/Users/Insert/Your/Preferred/Saving/Location/Path/Here/{participant_id}/{participant_id}_se.csv")
-        third_values.to_csv(f"/Users/Insert/Your/Preferred/Saving/Location/Path/Here/{participant_id}/{participant_id}_tval.csv")
-
-        ## Convert DataFrame to formatted text
-        with open(f"/Users/Insert/Your/Preferred/Saving/Location/Path/Here/{participant_id}/{participant_id}_extractedAM_matrix.txt", "w") as f:
-            for row in bin_matrix.itertuples(index=False):
-                row_str = "  ".join(str(row[i]) + ("  " if i == 17 else "") for i in range(len(row)))
-                f.write(row_str + "\n")
\ No newline at end of file
+def main(arguments=None):
+    parser = add_shard_arguments(argparse.ArgumentParser(description="Extract the first excellent fitting model of LISERAL AM outputs"))
+    args = parser.parse_args(arguments)
+    cohort_fit_path = f"{save_path}/{COHORT_FIT_FILENAME}"
+    edges_path = f"{save_path}/{EDGE_LIST_FILENAME}"
+    if args.merge:
+        merge_cohort_fit(cohort_fit_path, args.merge)
+        merge_edge_lists(partial_paths(edges_path, args.merge), edges_path)
+        return
+
+    cohort_rows = []
+    # The bulk writer writes each subject's files in the background while the next subject is parsed,
+    # and iter_texts reads/decompresses the next output files in the background as well.
+    # The bulk writer is closed first, so the edge list is newer than the beta files (see the converter)
+    with EdgeListWriter(edges_path if args.shard is None else partial_path(edges_path, args.shard)) as edges, BulkWriter() as writer:
+        # Iterate through all output txt files in the folder (or archive), compressed or not;
+        # with --shard only the files of this shard's subjects are read
+        for item_path, lines in iter_texts(folder_path, "*.txt", encoding='ISO-8859-1',
+                                           select=lambda path: in_shard(file_name(path), args.shard)):
+            # Process file
+            print(f"File: {item_path}")
+
+            input_path = item_path
+            subfile_name = file_name(item_path)
+            participant_id, participant_suffix = extract_number_and_text(subfile_name)
+            ################################ MODIFY HERE ####################################
+            ############# Switch to location where the LISERAL section txt file is saved ####
+            output_path = f"{save_path}/{participant_id}/{participant_id}_replace_with_your_file_name.txt"
+            #################################################################################
+            # A single read of the output gives the section, BETA, the extra matrices and the fit
+            results, fit = extract_lisrel_section(input_path, output_path, writer=writer, lines=lines)
+
+            ###### Here begins key function of extracting information from LISERAL formatted models ######
+            fit = write_extracted_files(writer, f"{save_path}/{participant_id}", participant_id, results, fit)
+            cohort_rows.append(cohort_fit_row(participant_id, fit))
+            # Estimated paths of the non-lagged rows (NaN = no path) go to the cohort edge list
+            if 'BETA' in results:
+                edges.add(participant_id, *(values[n_rois:] for values in results['BETA']))
+
+    if args.shard is None:
+        # Subjects ordered by ID, like a merge of shards (tar archives are read in member order)
+        sort_edge_list(edges_path)
+    os.makedirs(save_path, exist_ok=True)
+    write_cohort_fit(cohort_fit_path if args.shard is None else partial_path(cohort_fit_path, args.shard), cohort_rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+###################################################################################################
+################ Define functions to parse LISERAL output txt files into arrays ##################
+# Shared by the extraction scripts and the model/refit tools, so that a LISERAL output can be
+# parsed without running any of the extraction scripts' loops:
+# 1) select_am_model finds the FIRST excellent fitting model of an automatic search (AM) output
+#    (current criteria: 2 out of 4 goodness of fit statistics meets the standard);
+# 2) extract_model captures every configured matrix/section of that model (BETA, PSI, squared
+#    multiple correlations, ... see MATRICES) and its fit statistics in the same single pass, each
+#    as estimate/SE/t value arrays; extract_am_output does both on an output read once;
+# 3) parse_beta_matrices turns the BETA blocks of a saved section into beta/se/t value arrays.
+####################################################################################################
+
+import re
+from collections import namedtuple
+
+import numpy as np
+
+####################################### EDIT AS NEEDED ###################################################
+# Matrices/sections extracted from each model by default, in the same read as BETA
+MATRICES = ('BETA', 'PSI', 'Squared Multiple Correlations for Structural Equations')
+# Fit statistics read from each model's "Goodness of Fit Statistics", name -> label in the output
+FIT_STATISTICS = {
+    'df': 'Degrees of Freedom',
+    'chi_square': 'Minimum Fit Function Chi-Square',
+    'rmsea': 'Root Mean Square Error of Approximation (RMSEA)',
+    'nnfi': 'Non-Normed Fit Index (NNFI)',
+    'cfi': 'Comparative Fit Index (CFI)',
+    'srmr': 'Standardized RMR',
+}
+##########################################################################################################
+
+# Lines that end the estimates of a LISERAL model: the matrices after them (e.g. BETA and PSI of the
+# standardized solutions) must not be read as the estimates
+ESTIMATES_END = ('Goodness of Fit Statistics', 'Standardized Solution')
+
+# Lines starting a new section of a LISERAL model (matrix names and section titles)
+SECTION_HEADERS = {
+    'BETA', 'GAMMA', 'PSI', 'PHI', 'ALPHA', 'KAPPA', 'LAMBDA-Y', 'LAMBDA-X', 'THETA-EPS', 'THETA-DELTA',
+    'TAU-Y', 'TAU-X', 'Covariance Matrix of ETA', 'Covariance Matrix of Y and ETA', 'Correlation Matrix of ETA',
+    'Squared Multiple Correlations for Structural Equations', 'Squared Multiple Correlations for Reduced Form',
+    'Squared Multiple Correlations for Y - Variables', 'Goodness of Fit Statistics', 'Standardized Solution',
+    'Completely Standardized Solution', 'Total and Indirect Effects',
+}
+
+# Estimates, standard errors and t values of one LISERAL matrix
+LisrelMatrix = namedtuple('LisrelMatrix', ['estimate', 'se', 'tval'])
+
+# Function to find the FIRST excellent fitting model of an automatic search (AM) LISERAL output
+def find_am_model(lines, file_path=None, verbose=True):
+    """
+    Return (start, fit) for the first model meeting 2 out of 4 fit criteria, or for the final
+    model if none does. start is the index of its "LISREL Estimates (Maximum Likelihood)" line
+    (None if there is none); fit is a dict of rmsea, nnfi, cfi, srmr, criteria and excellent
+    (whether the criteria were met).
+    """
+    last_lisrel_index = None
+    rmsea_value = None
+    nnfi_value = None
+    cfi_value = None
+    srmr_value = None
+    criteria = 0
+    should_break = False
+    
+    for i, line in enumerate(lines):
+        if "LISREL Estimates (Maximum Likelihood)" in line:
+            last_lisrel_index = i
+        
+        if "Goodness of Fit Statistics" in line:
+            for j in range(i + 1, len(lines)):
+                if "LISREL Estimates (Maximum Likelihood)" in lines[j]:
+                    break  # Stop iterating when the next "LISREL Estimates (Maximum Likelihood)" is found
+                if "Root Mean Square Error of Approximation (RMSEA)" in lines[j]:
+                    rmsea_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
+                    rmsea_value = float(rmsea_value)
+                if "Non-Normed Fit Index (NNFI)" in lines[j]:
+                    nnfi_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
+                    nnfi_value = float(nnfi_value)
+                if "Comparative Fit Index (CFI)" in lines[j]:
+                    cfi_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
+                    cfi_value = float(cfi_value)
+                if "Standardized RMR" in lines[j]:
+                    srmr_value = lines[j].strip().split()[-1]  # Extract last element as value after stripping spaces
+                    srmr_value = float(srmr_value)
+
+                criteria = 0
+                if rmsea_value and rmsea_value <= 0.05:
+                    criteria += 1
+                if nnfi_value and nnfi_value >= 0.95:
+                    criteria += 1
+                if cfi_value and cfi_value >= 0.95:
+                    criteria += 1
+                if srmr_value and srmr_value <= 0.05:
+                    criteria += 1
+
+                if criteria >= 2:
+                    should_break = True
+                    if verbose:
+                        print("We found a model with excellent fit for participant=", file_path, " criteria=", criteria, " rmsea=", rmsea_value, " nnfi=", nnfi_value, " cfi=", cfi_value, " srmr=", srmr_value, " model starts on line=", last_lisrel_index)
+                    break
+            
+            if should_break:
+                break
+    if not should_break and verbose:
+        print("We did not find a model with excellent fit for participant=", file_path, " criteria=", criteria, " rmsea=", rmsea_value, " nnfi=", nnfi_value, " cfi=", cfi_value, " srmr=", srmr_value, " extracted the final model starting on line=", last_lisrel_index)
+
+    fit = {'rmsea': rmsea_value, 'nnfi': nnfi_value, 'cfi': cfi_value, 'srmr': srmr_value,
+           'criteria': criteria, 'excellent': should_break}
+    return last_lisrel_index, fit
+
+def model_section(lines, start):
+    """
+    Lines of the model starting at `start`, after "LISREL Estimates (Maximum Likelihood)" up to
+    "Covariance Matrix of ETA" (the part saved by the extraction scripts).
+    """
+    section = []
+    if start is not None:
+        for j in range(start + 1, len(lines)):
+            if "Covariance Matrix of ETA" in lines[j]:
+                break
+            section.append(lines[j])
+    return section
+
+def select_am_model(lines, file_path=None, verbose=True):
+    """
+    Return (section, fit) of the selected model (see find_am_model and model_section).
+    """
+    start, fit = find_am_model(lines, file_path, verbose)
+    return model_section(lines, start), fit
+
+def select_am_section(lines, file_path=None, verbose=True):
+    """
+    Return the lines of the selected model section only (see select_am_model).
+    """
+    return select_am_model(lines, file_path, verbose)[0]
+
+# Function to extract subID, expects that file name starts with "o", followed by subID
+def extract_number_and_text(filename):
+    match = re.match(r"o(\d{5})([a-zA-Z]*)\.txt", filename)
+    if match:
+        return match.group(1), match.group(2)
+    return None, None
+
+# Function to strip white spaces and parentheses due to LISERAL output formatting
+def parse_token(token):
+    """
+    Remove surrounding whitespace and parentheses.
+    Convert the token to a float if possible; otherwise, return np.nan.
+    """
+    token = token.strip()
+    if token in ['- -', '--', '']:
+        return np.nan
+    token = token.strip("()")
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+# Function to split LISERAL output lines into named sections in a single pass
+def split_sections(lines, names):
+    """
+    Collect the lines of every section listed in `names` (matrix names such as "BETA" or
+    section titles such as "Squared Multiple Correlations for Structural Equations").
+    A section runs until the next known header (SECTION_HEADERS); repeated headers (wide
+    matrices printed in several panels) are collected into the same section.
+    """
+    sections = {name: [] for name in names}
+    current = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped in SECTION_HEADERS or stripped in sections:
+            current = stripped
+            continue
+        if current in sections:
+            sections[current].append(line)
+    return sections
+
+# Function to parse the lines of one LISERAL matrix section into estimate, SE and t value arrays
+def parse_matrix_block(lines, n_vars=36):
+    """
+    Parse a LISERAL matrix section (one or more panels of "VAR" column headers followed by row
+    groups of estimate / (SE) / t value lines). Matrices printed as a single row of values
+    (diagonal matrices, squared multiple correlations) are put on the diagonal when the section
+    notes "This matrix is diagonal", and returned as 1 x n_vars arrays otherwise.
+    Returns a LisrelMatrix of float arrays, NaN where nothing is estimated.
+    """
+    is_diagonal = any("This matrix is diagonal" in line for line in lines)
+    has_rows = any(re.match(r'^\s*VAR\s+\d+\s{2,}\S', line) and not _is_column_header(line) for line in lines)
+    shape = (n_vars, n_vars) if has_rows or is_diagonal else (1, n_vars)
+    estimate = np.full(shape, np.nan)
+    se = np.full(shape, np.nan)
+    tval = np.full(shape, np.nan)
+
+    col_nums = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if _is_column_header(line):
+            # Extract column variable numbers (e.g., "VAR 1", "VAR 2", …)
+            col_nums = [int(re.search(r'\d+', c).group()) - 1 for c in re.findall(r'VAR\s+\d+', line)]
+        elif col_nums and re.match(r'^\s*VAR\s+\d+', line):
+            # This is the first line of a row group.
+            tokens1 = re.split(r'\s{2,}', line.strip())
+            row_num = int(re.search(r'\d+', tokens1[0]).group()) - 1
+            vals1 = tokens1[1:]
+            vals2 = []
+            vals3 = []
+            if not all(x == "- -" for x in vals1):
+                # The next two lines hold the standard errors and the t values.
+                if i + 1 < len(lines):
+                    vals2 = re.split(r'\s{2,}', lines[i+1].strip())
+                if i + 2 < len(lines):
+                    vals3 = re.split(r'\s{2,}', lines[i+2].strip())
+
+            # vals1 is always sparse and vals2 and vals3 are dense arrays.
+            for j in range(min(len(vals1), len(col_nums))):
+                col_num = col_nums[j]
+                v1 = parse_token(vals1[j])
+                estimate[row_num, col_num] = v1
+                if not np.isnan(v1) and vals2 and vals3:
+                    se[row_num, col_num] = parse_token(vals2.pop(0))
+                    tval[row_num, col_num] = parse_token(vals3.pop(0))
+        elif col_nums and not has_rows and _is_value_line(line):
+            # A single row of values, optionally followed by its (SE) and t value lines
+            rows = [re.split(r'\s{2,}', line.strip())]
+            while len(rows) < 3 and i + 1 < len(lines) and _is_value_line(lines[i+1]):
+                i += 1
+                rows.append(re.split(r'\s{2,}', lines[i].strip()))
+            for target, tokens in zip((estimate, se, tval), rows):
+                for col_num, token in zip(col_nums, tokens):
+                    if is_diagonal:
+                        target[col_num, col_num] = parse_token(token)
+                    else:
+                        target[0, col_num] = parse_token(token)
+            col_nums = []
+        i += 1
+
+    return LisrelMatrix(estimate, se, tval)
+
+def _is_column_header(line):
+    return re.match(r'^\s*(VAR\s+\d+\s*)+$', line) is not None
+
+def _is_value_line(line):
+    tokens = line.split()
+    return bool(tokens) and all(not np.isnan(parse_token(t)) for t in tokens)
+
+# Function to parse the BETA blocks of an extracted LISERAL section into three 36x36 float arrays
+def parse_beta_matrices(raw_text, n_vars=36):
+    """
+    Parse the BETA blocks of an extracted LISREL section.
+    Returns (beta, se, tval) as n_vars x n_vars float arrays, NaN where no path is estimated.
+    """
+    lines = raw_text.splitlines()
+    return tuple(parse_matrix_block(split_sections(lines, ['BETA'])['BETA'], n_vars))
+
+# Function to parse the fit statistics of one model
+def parse_fit_statistics(lines, statistics=None):
+    """
+    Return {name: value} for the FIT_STATISTICS labels found in the given lines: the number right
+    after "=" (the last number on the line when there is no "="). A P-value printed after a
+    statistic, e.g. "Minimum Fit Function Chi-Square = 612.34 (P = 0.00045)", is stored as name_p.
+    """
+    statistics = FIT_STATISTICS if statistics is None else statistics
+    fit = {}
+    for line in lines:
+        for name, label in statistics.items():
+            if name not in fit and label in line:
+                rest = line.split(label, 1)[1]
+                match = re.match(r'\s*=\s*(\S+)', rest)
+                fit[name] = parse_token(match.group(1) if match else line.strip().split()[-1])
+                p_value = re.search(r'\(\s*P\s*=\s*([^)\s]+)\s*\)', rest)
+                if p_value:
+                    fit[f"{name}_p"] = parse_token(p_value.group(1))
+    return fit
+
+# Function to extract every configured matrix and the fit statistics of one model in a single pass
+def extract_model(lines, start, matrices=MATRICES, n_vars=36):
+    """
+    Extract the model starting at line index `start` (its "LISREL Estimates (Maximum Likelihood)"
+    line), up to the next model or the end of the output. Returns ({name: LisrelMatrix}, fit)
+    for every name in `matrices` found in the model's estimates plus the FIT_STATISTICS of its
+    "Goodness of Fit Statistics". Matrices that are not printed are left out of the results.
+
+    The estimates end at the first ESTIMATES_END line, so the BETA and PSI of the (completely)
+    standardized solutions are never read as estimates; BETA itself ends at the next section
+    ("Covariance Matrix of ETA"), as in the original extractor.
+    """
+    if start is None:
+        return {}, {}
+    end = len(lines)
+    for j in range(start + 1, len(lines)):
+        if "LISREL Estimates (Maximum Likelihood)" in lines[j]:
+            end = j
+            break
+    estimates_end = next((j for j in range(start + 1, end) if any(e in lines[j] for e in ESTIMATES_END)), end)
+    sections = split_sections(lines[start + 1:estimates_end], matrices)
+    results = {name: parse_matrix_block(sections[name], n_vars) for name in matrices if sections[name]}
+    # The fit statistics run from "Goodness of Fit Statistics" to the standardized solutions
+    fit_lines = []
+    for line in lines[estimates_end:end]:
+        if 'Standardized Solution' in line and fit_lines:
+            break
+        if fit_lines or 'Goodness of Fit Statistics' in line:
+            fit_lines.append(line)
+    return results, parse_fit_statistics(fit_lines)
+
+def extract_am_output(lines, file_path=None, matrices=MATRICES, n_vars=36, verbose=True):
+    """
+    One pass over an automatic search (AM) output already read into `lines`: select the model
+    (find_am_model) and extract its section, configured matrices and fit statistics.
+    Returns (section, {name: LisrelMatrix}, fit).
+    """
+    start, am_fit = find_am_model(lines, file_path, verbose)
+    results, fit = extract_model(lines, start, matrices, n_vars)
+    fit.update(criteria=am_fit['criteria'], excellent=am_fit['excellent'])
+    return model_section(lines, start), results, fit
@@ -0,0 +1,227 @@
+###################################################################################################
+############ Define a driver for the indSEM refit loop (QC -> LISERAL inputs -> extract) #########
+# This script replaces the manual refit workflow (search_indSEM_betapsi_commented.py, then
+# convertMatrix_txtinput_commented.py per subject, then liseral_AM_extract_commented.py) with one
+# command. It works in stages:
+#
+#   prepare  reads the QC result table (bad_subIDs.csv), reads the indSEM path txt file (lines of
+#            "lhs ~ rhs") of every flagged subject in parallel, builds all LISERAL 0/1 input matrices
+#            in one vectorized batch (lag diagonal set to 1, as when refitting from scratch) and
+#            writes them to INPUT_MATRIX_TEMPLATE;
+#   run      (only with `all`, which requires --lisrel-cmd) runs LISERAL in parallel for the subjects
+#            whose input matrix prepare wrote; subjects whose run fails are left out of the extract
+#            stage, and the driver exits with an error when every run fails;
+#   extract  picks up the LISERAL output txt files (o#####.txt) of the flagged subjects (with `all`,
+#            of the subjects that were prepared and run) that are newer
+#            than their input matrix (older outputs are from a previous fit and skipped), parses them
+#            in parallel worker processes and writes the same extracted files as the AM extractor
+#            (write_extracted_files), including the extra matrices and fit statistics, and replaces
+#            the refit subjects' paths in the cohort edge list (see edge_list_commented.py).
+#
+# Usage:
+#   python refit_driver_commented.py prepare <bad_subIDs.csv>
+#   python refit_driver_commented.py extract <bad_subIDs.csv> <liseral_output_folder> <save_folder>
+#   python refit_driver_commented.py all <bad_subIDs.csv> <liseral_output_folder> <save_folder> \
+#          --lisrel-cmd "lisrel85 {sid}.LS8 {output}"
+####################################################################################################
+
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bulk_output_writer_commented import BulkWriter
+from compressed_io_commented import join, modified_time, open_text, resolve
+from edge_list_commented import EDGE_LIST_FILENAME, EdgeListWriter
+from gimme_model_commented import GimmeModel
+from liseral_AM_extract_commented import write_extracted_files
+from lisrel_output_parser_commented import extract_am_output
+from roi_registry_commented import get_registry
+
+####################################### EDIT AS NEEDED ###################################################
+# indSEM path txt file of each subject, formatted with the QC sub_id (e.g. 'csm14aff10005_1')
+PATHS_TEMPLATE = "your_folder/{sub_id}_paths.txt"
+# LISERAL input matrix written for each subject, formatted with the five-digit id
+INPUT_MATRIX_TEMPLATE = "./InputMatrix/{sid}_matrix_facespaths_restingMRI_fromscratch.txt"
+# Name of the extracted LISERAL section txt file in each subject's save folder
+SECTION_FILENAME = "{sid}_extractedAM.txt"
+# Number of parallel workers for reading, running LISERAL and parsing
+WORKERS = os.cpu_count() or 4
+##########################################################################################################
+
+
+def five_digit_id(sub_id):
+    """Five-digit participant ID of a QC sub_id ('csm14aff10005_1' or 'sub-10005')."""
+    match = re.search(r'\d{5}', str(sub_id))
+    return match.group(0) if match else str(sub_id)
+
+
+def flagged_subjects(qc_path):
+    """
+    Read the QC result table of search_indSEM_betapsi_commented.py and return the flagged rows
+    (bad beta and/or psi), with a five-digit 'sid' column added.
+    """
+    with open_text(qc_path) as file:
+        qc = pd.read_csv(file)
+    flags = [c for c in ('bad_beta', 'bad_psi') if c in qc]
+    if flags:
+        qc = qc.loc[qc[flags].astype(str).apply(lambda c: c.str.lower() == 'true').any(axis=1)]
+    qc = qc.assign(sid=qc['sub_id'].map(five_digit_id))
+    return qc.reset_index(drop=True)
+
+
+def read_paths(path):
+    """Read an indSEM path txt file (lines of 'lhs ~ rhs') into a [lhs, rhs] DataFrame."""
+    with open_text(path) as file:
+        try:
+            return pd.read_csv(file, sep=r'\s*~\s*', header=None, names=['lhs', 'rhs'], engine='python',
+                               skipinitialspace=True).dropna()
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame(columns=['lhs', 'rhs'])
+
+
+def prepare(qc, writer):
+    """
+    Build and queue the LISERAL input matrices of all flagged subjects in one batch.
+    Returns the sids whose input matrix was written (subjects without a path file are left out;
+    a path file without any path gives the lag-diagonal matrix, as convertMatrix_txtinput does).
+    """
+    paths = [PATHS_TEMPLATE.format(sub_id=sub_id) for sub_id in qc['sub_id']]
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        tables = list(pool.map(_read_paths_or_none, paths))
+
+    frames, sids = [], []
+    for sid, path, table in zip(qc['sid'], paths, tables):
+        if table is None:
+            print(f"Warning: missing path file for {sid}: {path}")
+            continue
+        if table.empty:
+            print(f"Warning: no 'lhs ~ rhs' paths in {path} for {sid}, writing the lag diagonal only")
+        frames.append(table.assign(file=sid))
+        sids.append(sid)
+    if not frames:
+        print("No path files found. Nothing to prepare.")
+        return []
+
+    # Every subject with a path file is in the model, also when the file has no paths
+    model = GimmeModel.from_r_frame(pd.concat(frames, ignore_index=True), subject_ids=sids)
+    # Always estimate the autoregressive (lag diagonal) paths when refitting from scratch
+    n = get_registry().n_rois
+    model.mask[:, np.arange(n), np.arange(n)] = 1
+    model.write_lisrel_matrices(INPUT_MATRIX_TEMPLATE, writer)
+    print(f"Queued {len(model)} LISERAL input matrices.")
+    return model.subject_ids
+
+
+def _read_paths_or_none(path):
+    path = resolve(path)
+    return read_paths(path) if path is not None else None
+
+
+def run_lisrel(sids, command, output_folder):
+    """
+    Run LISERAL for the given subjects in parallel, command is formatted with sid, matrix and output.
+    Returns the set of sids whose run failed.
+    """
+    def run_one(sid):
+        args = command.format(sid=sid, matrix=INPUT_MATRIX_TEMPLATE.format(sid=sid),
+                              output=os.path.join(output_folder, f"o{sid}.txt"))
+        result = subprocess.run(shlex.split(args))
+        if result.returncode != 0:
+            print(f"Warning: LISERAL failed for {sid} (exit code {result.returncode}), not extracting it")
+            return sid
+        return None
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        return {sid for sid in pool.map(run_one, sids) if sid is not None}
+
+
+def is_stale(sid, output_path):
+    """Whether a LISERAL output is older than the subject's input matrix (i.e. from a previous fit)."""
+    matrix_path = resolve(INPUT_MATRIX_TEMPLATE.format(sid=sid))
+    return matrix_path is not None and modified_time(output_path) < modified_time(matrix_path)
+
+
+def _extract_one(path):
+    # Runs in a worker process: one read gives the model section, all configured matrices and the fit
+    with open_text(path, encoding='ISO-8859-1') as file:
+        return extract_am_output(file.readlines(), path, n_vars=get_registry().n_vars)
+
+
+def extract(qc, output_folder, save_folder, writer, failed=()):
+    """
+    Parse the LISERAL outputs of all flagged subjects (except those in `failed`) in parallel and
+    queue the extracted files. Outputs older than their input matrix are skipped.
+    """
+    outputs = {sid: join(output_folder, f"o{sid}.txt") for sid in qc['sid'] if sid not in failed}
+    found = {sid: resolve(path) for sid, path in outputs.items()}
+    for sid, path in found.items():
+        if path is None:
+            print(f"Warning: missing LISERAL output for {sid}: {outputs[sid]}")
+        elif is_stale(sid, path):
+            print(f"Warning: LISERAL output for {sid} is older than its input matrix, skipping: {path}")
+            found[sid] = None
+    outputs = {sid: path for sid, path in found.items() if path is not None}
+    if not outputs:
+        print("No LISERAL outputs found. Nothing to extract.")
+        return 0
+
+    n = get_registry().n_rois
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool, EdgeListWriter(f"{save_folder}/{EDGE_LIST_FILENAME}", update=True) as edges:
+        for sid, (section, results, fit) in zip(outputs, pool.map(_extract_one, outputs.values())):
+            writer.write_text(f"{save_folder}/{sid}/" + SECTION_FILENAME.format(sid=sid), ''.join(section))
+            write_extracted_files(writer, f"{save_folder}/{sid}", sid, results, fit)
+            if 'BETA' in results:
+                edges.add(sid, *(values[n:] for values in results['BETA']))
+        # The edge list is written last, so it is newer than the beta files it replaces (see the converter)
+        writer.wait()
+    print(f"Queued extracted files for {len(outputs)} subjects.")
+    return len(outputs)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="indSEM refit loop driver")
+    parser.add_argument('stage', choices=['prepare', 'extract', 'all'])
+    parser.add_argument('qc_csv', help="bad_subIDs.csv from search_indSEM_betapsi_commented.py")
+    parser.add_argument('output_folder', nargs='?', help="folder with the LISERAL o#####.txt outputs")
+    parser.add_argument('save_folder', nargs='?', help="folder to save the extracted files in")
+    parser.add_argument('--lisrel-cmd', help="LISERAL command template, formatted with {sid}, {matrix} and {output}")
+    args = parser.parse_args(arguments)
+
+    if args.stage != 'prepare' and (args.output_folder is None or args.save_folder is None):
+        parser.error("extract and all need <output_folder> and <save_folder>")
+    if args.stage == 'all' and not args.lisrel_cmd:
+        parser.error("all needs --lisrel-cmd (use prepare, run LISERAL, then extract otherwise)")
+
+    qc = flagged_subjects(args.qc_csv)
+    print(f"{len(qc)} flagged subject(s) in {args.qc_csv}")
+
+    with BulkWriter() as writer:
+        if args.stage in ('prepare', 'all'):
+            prepared = prepare(qc, writer)
+    failed = set()
+    if args.stage == 'all':
+        # Only subjects with a freshly written input matrix are run (and then extracted): an older
+        # matrix left from a previous prepare would give an output that looks like a new refit
+        qc = qc.loc[qc['sid'].isin(prepared)].reset_index(drop=True)
+        if qc.empty:
+            print("No LISERAL input matrices were written. Nothing to run.")
+            return 1
+        failed = run_lisrel(list(dict.fromkeys(qc['sid'])), args.lisrel_cmd, args.output_folder)
+        if failed.issuperset(qc['sid']):
+            print("LISERAL failed for every subject. Nothing to extract.")
+            return 1
+    if args.stage in ('extract', 'all'):
+        with BulkWriter() as writer:
+            extract(qc, args.output_folder, args.save_folder, writer, failed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
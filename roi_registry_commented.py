@@ -0,0 +1,115 @@
+###################################################################################################
+############ Define the ROI registry shared by all converters and extractors #####################
+# The ROI layout (network, index within the network, lag and non-lag VAR numbers) is defined once
+# here and loaded once per run. Every converter maps labels through the precomputed NumPy lookup
+# arrays below instead of per-row string manipulation ('lag' in rhs, rhs[:-3], ...).
+#
+# Label codes: every label gets an integer code equal to its LISREL VAR number minus 1, i.e.
+#   codes 0 .. n-1   are the lagged ROIs ('DMN_1lag', ...)       -> VAR 1  .. VAR n
+#   codes n .. 2n-1  are the contemporaneous ROIs ('DMN_1', ...)  -> VAR n+1 .. VAR 2n
+# so `code % n` is the ROI index (row/column of the 0/1 matrices) and `code < n` marks lagged paths.
+# A LISREL input matrix row is therefore simply row `roi` of an n x 2n array indexed by code.
+####################################################################################################
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+####################################### EDIT AS NEEDED ###################################################
+# Networks and number of ROIs per network, in VAR order - should match those used in R GIMME
+ROI_LAYOUT = [('DMN', 6), ('SAL', 6), ('FPN', 6)]
+# Optional csv file with columns 'network', 'roi' (one row per ROI, in VAR order) overriding ROI_LAYOUT
+ROI_LAYOUT_FILE = None
+# Suffix used by R GIMME for lagged variables
+LAG_SUFFIX = 'lag'
+##########################################################################################################
+
+
+class ROIRegistry:
+    """
+    Precomputed lookup arrays for one ROI layout. Build it with get_registry().
+    """
+
+    def __init__(self, networks, rois):
+        n = len(rois)
+        self.n_rois = n
+        self.n_vars = 2 * n
+        # ROI names in index order, e.g. 'DMN_1'
+        self.rois = np.asarray(rois, dtype=object)
+        # Network of each ROI as categorical codes
+        network_cat = pd.Categorical(networks, categories=list(dict.fromkeys(networks)))
+        self.network_names = np.asarray(network_cat.categories, dtype=object)
+        self.network_codes = np.asarray(network_cat.codes, dtype=np.int8)
+        # VAR numbers of each ROI
+        self.lag_var = np.arange(1, n + 1)
+        self.nonlag_var = np.arange(n + 1, 2 * n + 1)
+        # Lookup arrays indexed by label code
+        self.labels = np.concatenate([self.rois + LAG_SUFFIX, self.rois])
+        self.code_roi = np.tile(np.arange(n), 2)
+        self.code_is_lag = np.arange(2 * n) < n
+        self.var_names = np.asarray([f"VAR {i}" for i in range(1, 2 * n + 1)], dtype=object)
+        self._label_index = pd.Index(self.labels)
+
+    def encode(self, labels):
+        """
+        Map an array of R GIMME labels ('DMN_1', 'SAL_2lag', ...) to label codes.
+        Raises KeyError listing any label that is not part of the layout.
+        """
+        labels = pd.Series(np.asarray(labels, dtype=object)).astype(str).str.strip()
+        codes = self._label_index.get_indexer(labels)
+        if (codes < 0).any():
+            raise KeyError(f"unknown ROI labels: {sorted(set(labels[codes < 0]))}")
+        return codes
+
+    def encode_lhs(self, labels):
+        """
+        Map an array of lhs labels to ROI indices (rows of the n x 2n matrix).
+        Raises KeyError for unknown labels and for lagged labels, which cannot be lhs.
+        """
+        codes = self.encode(labels)
+        if self.code_is_lag[codes].any():
+            raise KeyError(f"lagged ROI labels cannot be lhs: {sorted(set(self.labels[codes[self.code_is_lag[codes]]]))}")
+        return self.code_roi[codes]
+
+    def encode_vars(self, var_labels):
+        """
+        Map an array of LISREL variable labels ('VAR 19', 'VAR19', ...) to label codes.
+        """
+        return np.asarray([var_code(str(v)) for v in var_labels], dtype=np.intp)
+
+    def adjacency(self, lhs, rhs, lag_diagonal=False):
+        """
+        Build the n x 2n 0/1 matrix of paths lhs <- rhs (lag block first, then non-lag block),
+        i.e. exactly the layout of a LISREL input matrix txt file.
+        Raises KeyError for unknown labels and for lagged labels on the lhs.
+        """
+        mask = np.zeros((self.n_rois, self.n_vars), dtype=np.int8)
+        rows = self.encode_lhs(lhs)
+        rhs_codes = self.encode(rhs)
+        mask[rows, rhs_codes] = 1
+        if lag_diagonal:
+            mask[np.arange(self.n_rois), np.arange(self.n_rois)] = 1
+        return mask
+
+
+@lru_cache(maxsize=None)
+def var_code(var_label):
+    """Label code of a LISREL variable label such as 'VAR 19' (memoized)."""
+    return int(re.search(r'\d+', var_label).group()) - 1
+
+
+@lru_cache(maxsize=None)
+def get_registry(layout_file=ROI_LAYOUT_FILE):
+    """
+    Load the ROI layout once per run and return its ROIRegistry.
+    """
+    if layout_file is not None:
+        layout = pd.read_csv(layout_file)
+        networks = layout['network'].astype(str).str.strip().tolist()
+        rois = layout['roi'].astype(str).str.strip().tolist()
+    else:
+        networks = [network for network, count in ROI_LAYOUT for _ in range(count)]
+        rois = [f"{network}_{i}" for network, count in ROI_LAYOUT for i in range(1, count + 1)]
+    return ROIRegistry(networks, rois)
@@ -4,104 +4,163 @@
 # that contain any values greater than 1 or less than -1, which are considered "bad" beta/psi values.
 # The function generates a summary CSV file listing participant IDs with bad beta and/or psi files,
 # along with detailed logs of the specific anomalies found.
+#
+# For multi-node runs, use --shard i/N to search one shard of the subject folders per node and
+# --merge N to combine the partial outputs (see sharding_commented.py). All outputs are ordered by
+# sub_id, so a merged run gives the same files as a single-node run.
 ####################################################################################################
 
 from pathlib import Path
+import argparse
+import os
 import re
 import pandas as pd
+
+from compressed_io_commented import ARCHIVE_SEPARATOR, file_name, list_files, list_folders, open_text
+from sharding_commented import add_shard_arguments, in_shard, partial_path, partial_paths, write_atomic
 ##################################################################################
 # Change folder paths as needed
+# (folder_path may also be a zip/tar archive of the indSEM output folder)
 folder_path = Path("your_input_folder_path/GIMME/output_indSEM_folder")
 save_path = Path("your_output_path/indSEM_Refit_SubList")
 ##################################################################################
 
-bad_sub_ids_dict = {}
-detailed_logs = []
-missing_files = []
-
-# Regex patterns for Betas and Psi files
-pattern_betas = re.compile(r"(csm14aff\d+_\d+|sub-\d+)Betas\.csv$")
-pattern_psi = re.compile(r"(csm14aff\d+_\d+|sub-\d+)Psi\.csv$")
-
-# Check for subfolders with the expected structure
-for subfolder in folder_path.glob("*/individual"):
-
-    matched_files = list(subfolder.glob("*.csv"))
-    matched = False
-    current_sub_issues = {}
-    current_sub_id = None
-
-    for csv_file in matched_files:
-        sub_id = None
-        file_type = None
-
-        if pattern_betas.search(csv_file.name):
-            sub_id = pattern_betas.search(csv_file.name).group(1)
-            file_type = "beta"
-        elif pattern_psi.search(csv_file.name):
-            sub_id = pattern_psi.search(csv_file.name).group(1)
-            file_type = "psi"
-
-        if sub_id:
-            current_sub_id = sub_id  # Save sub_id even if issues not found
-            matched = True
-            # print(f"Processing {file_type} file: {csv_file}")
-            print(f"Checking participant {sub_id}...")
-
-            df = pd.read_csv(csv_file)
-
-            if file_type == "beta":
-                df = df.loc[:, ~df.columns.str.contains("lag", case=False)]
-
-            numeric_df = df.select_dtypes(include='number')
-            bad_mask = (numeric_df > 1) | (numeric_df < -1)
-
-            if bad_mask.any().any():
-                print(f"  → bad {file_type} found")
-                current_sub_issues[file_type] = True
-
-                for row_idx, col in zip(*bad_mask.to_numpy().nonzero()):
-                    column_name = numeric_df.columns[col]
-                    value = numeric_df.iat[row_idx, col]
-                    log_msg = f"    [row {row_idx}, column '{column_name}']: {value}"
-                    print(log_msg)
-                    detailed_logs.append(f"{sub_id} ({file_type}) - {log_msg}")
-            else:
-                print(f"  → {file_type} ok")
-
-    if current_sub_id:
-        bad_sub_ids_dict[current_sub_id] = {
-            "bad_psi": current_sub_issues.get("psi", False),
-            "bad_beta": current_sub_issues.get("beta", False),
-        }
-
-    if not matched:
-        fallback_id_match = re.search(r"(csm14aff\d+_\d+|sub-\d+)", str(subfolder.parent.name))
-        fallback_id = fallback_id_match.group(1) if fallback_id_match else subfolder.parent.name
-        missing_files.append(fallback_id)
-        print(f"  → No matching Psi or Beta file found for {fallback_id}")
-
-# After all subfolder checks, filter out cases where both bad_psi and bad_beta are False
-bad_sub_ids_dict = {sub_id: issues for sub_id, issues in bad_sub_ids_dict.items() if issues["bad_psi"] or issues["bad_beta"]}
-
-# Save bad subIDs to CSV
-bad_subids_df = pd.DataFrame.from_dict(bad_sub_ids_dict, orient='index')
-bad_subids_df.index.name = 'sub_id'
-bad_subids_df.reset_index(inplace=True)
-
-bad_subids_df.to_csv(save_path / "bad_subIDs.csv", index=False)
-
-# Save detailed log
-log_path = save_path / "bad_file_details.txt"
-with open(log_path, "w") as f:
-    for log in detailed_logs:
-        f.write(log + "\n")
-
-# Save missing file list
-missing_path = save_path / "missing_files.txt"
-with open(missing_path, "w") as f:
-    for m in missing_files:
-        f.write(m + "\n")
-
-print(f"\nDone. {len(bad_subids_df)} bad file(s) found.")
-print(f"{len(missing_files)} missing file(s) recorded.")
+# Output file names in save_path
+BAD_SUBIDS_FILENAME = "bad_subIDs.csv"
+DETAILS_FILENAME = "bad_file_details.txt"
+MISSING_FILENAME = "missing_files.txt"
+
+def write_outputs(bad_sub_ids_dict, detailed_logs, missing_files, shard=None):
+    """
+    Save the bad subIDs csv, the detailed log and the missing file list (the partial outputs of
+    `shard` if given), ordered by sub_id. Returns the number of bad subIDs.
+    """
+    # Same order whichever order (or shard) the subject folders were searched in
+    bad_sub_ids_dict = dict(sorted(bad_sub_ids_dict.items()))
+    detailed_logs = sorted(detailed_logs, key=lambda log: log.split(" (", 1)[0])
+    missing_files = sorted(missing_files)
+
+    def output_path(name):
+        return save_path / name if shard is None else Path(partial_path(save_path / name, shard))
+
+    # Save bad subIDs to CSV
+    bad_subids_df = pd.DataFrame.from_dict(bad_sub_ids_dict, orient='index')
+    bad_subids_df.index.name = 'sub_id'
+    bad_subids_df.reset_index(inplace=True)
+
+    write_atomic(output_path(BAD_SUBIDS_FILENAME), bad_subids_df.to_csv(index=False))
+
+    # Save detailed log
+    write_atomic(output_path(DETAILS_FILENAME), ''.join(log + "\n" for log in detailed_logs))
+
+    # Save missing file list
+    write_atomic(output_path(MISSING_FILENAME), ''.join(m + "\n" for m in missing_files))
+    return len(bad_subids_df)
+
+def read_partial_outputs(count):
+    """Read the partial outputs of `count` shards back into (bad_sub_ids_dict, detailed_logs, missing_files)."""
+    bad_sub_ids_dict, detailed_logs, missing_files = {}, [], []
+    for path in partial_paths(save_path / BAD_SUBIDS_FILENAME, count):
+        for row in pd.read_csv(path).to_dict('records'):
+            bad_sub_ids_dict[row['sub_id']] = {"bad_psi": row['bad_psi'], "bad_beta": row['bad_beta']}
+    for path in partial_paths(save_path / DETAILS_FILENAME, count):
+        with open(path) as f:
+            detailed_logs.extend(f.read().splitlines())
+    for path in partial_paths(save_path / MISSING_FILENAME, count):
+        with open(path) as f:
+            missing_files.extend(f.read().splitlines())
+    return bad_sub_ids_dict, detailed_logs, missing_files
+
+def main(arguments=None):
+    parser = add_shard_arguments(argparse.ArgumentParser(description="Search indSEM GIMME outputs for bad beta and psi values"))
+    args = parser.parse_args(arguments)
+    if args.merge:
+        bad_sub_ids_dict, detailed_logs, missing_files = read_partial_outputs(args.merge)
+        n_bad = write_outputs(bad_sub_ids_dict, detailed_logs, missing_files)
+        print(f"Merged {args.merge} shards. {n_bad} bad file(s) found.")
+        print(f"{len(missing_files)} missing file(s) recorded.")
+        return
+
+    bad_sub_ids_dict = {}
+    detailed_logs = []
+    missing_files = []
+
+    # Regex patterns for Betas and Psi files
+    pattern_betas = re.compile(r"(csm14aff\d+_\d+|sub-\d+)Betas\.csv$")
+    pattern_psi = re.compile(r"(csm14aff\d+_\d+|sub-\d+)Psi\.csv$")
+
+    # Check for subfolders with the expected structure; folder_path may also be a zip/tar archive
+    # and the csv files may be .gz/.bz2/.xz compressed
+    for subfolder in list_folders(folder_path, "*/individual"):
+        # Name of the subject folder that contains "individual"
+        parent_name = os.path.basename(os.path.dirname(subfolder).split(ARCHIVE_SEPARATOR)[-1])
+        if not in_shard(parent_name, args.shard):
+            continue
+
+        matched_files = list_files(subfolder, "*.csv")
+        matched = False
+        current_sub_issues = {}
+        current_sub_id = None
+
+        for csv_file in matched_files:
+            sub_id = None
+            file_type = None
+            csv_name = file_name(csv_file)
+
+            if pattern_betas.search(csv_name):
+                sub_id = pattern_betas.search(csv_name).group(1)
+                file_type = "beta"
+            elif pattern_psi.search(csv_name):
+                sub_id = pattern_psi.search(csv_name).group(1)
+                file_type = "psi"
+
+            if sub_id:
+                current_sub_id = sub_id  # Save sub_id even if issues not found
+                matched = True
+                # print(f"Processing {file_type} file: {csv_file}")
+                print(f"Checking participant {sub_id}...")
+
+                with open_text(csv_file) as file:
+                    df = pd.read_csv(file)
+
+                if file_type == "beta":
+                    df = df.loc[:, ~df.columns.str.contains("lag", case=False)]
+
+                numeric_df = df.select_dtypes(include='number')
+                bad_mask = (numeric_df > 1) | (numeric_df < -1)
+
+                if bad_mask.any().any():
+                    print(f"  → bad {file_type} found")
+                    current_sub_issues[file_type] = True
+
+                    for row_idx, col in zip(*bad_mask.to_numpy().nonzero()):
+                        column_name = numeric_df.columns[col]
+                        value = numeric_df.iat[row_idx, col]
+                        log_msg = f"    [row {row_idx}, column '{column_name}']: {value}"
+                        print(log_msg)
+                        detailed_logs.append(f"{sub_id} ({file_type}) - {log_msg}")
+                else:
+                    print(f"  → {file_type} ok")
+
+        if current_sub_id:
+            bad_sub_ids_dict[current_sub_id] = {
+                "bad_psi": current_sub_issues.get("psi", False),
+                "bad_beta": current_sub_issues.get("beta", False),
+            }
+
+        if not matched:
+            fallback_id_match = re.search(r"(csm14aff\d+_\d+|sub-\d+)", parent_name)
+            fallback_id = fallback_id_match.group(1) if fallback_id_match else parent_name
+            missing_files.append(fallback_id)
+            print(f"  → No matching Psi or Beta file found for {fallback_id}")
+
+    # After all subfolder checks, filter out cases where both bad_psi and bad_beta are False
+    bad_sub_ids_dict = {sub_id: issues for sub_id, issues in bad_sub_ids_dict.items() if issues["bad_psi"] or issues["bad_beta"]}
+
+    n_bad = write_outputs(bad_sub_ids_dict, detailed_logs, missing_files, args.shard)
+
+    print(f"\nDone. {n_bad} bad file(s) found.")
+    print(f"{len(missing_files)} missing file(s) recorded.")
+
+if __name__ == '__main__':
+    main()
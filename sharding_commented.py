@@ -0,0 +1,113 @@
+###################################################################################################
+############ Define deterministic subject sharding for multi-node cohort processing ##############
+# The AM extractor, the beta-to-R converter and the indSEM search accept
+#
+#   --shard i/N   process only the subjects of shard i (0 .. N-1) and write partial outputs
+#   --merge N     combine the N partial outputs into the outputs of a single-node run
+#
+# Subjects are assigned to shards by a hash of their five-digit ID (or of the whole name when it has
+# none), so the assignment is the same on every node and in every script, and needs no shared state
+# besides the filesystem. A partial output is named after the final output with ".shard-i-of-N"
+# inserted before the extension (e.g. GIMME_r_format_output.shard-0-of-4.csv) and is written
+# atomically, so a merge never reads a half-written partial.
+#
+# To test locally, run N shard processes on one machine and merge their outputs:
+#   python sharding_commented.py 4 python convert_LISERALbeta_to_resting_commented.py <root> <ref.csv>
+####################################################################################################
+
+import argparse
+import hashlib
+import os
+import re
+import subprocess
+import sys
+
+
+def parse_shard(text):
+    """Parse an 'i/N' shard specification into (i, N), with 0 <= i < N."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', str(text))
+    if match is None:
+        raise ValueError(f"shard must be given as i/N, got {text!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError(f"shard index must be in 0..N-1, got {text!r}")
+    return index, count
+
+
+def subject_key(name):
+    """Five-digit participant ID in a file or folder name, or the name itself when there is none."""
+    match = re.search(r'\d{5}', str(name))
+    return match.group(0) if match else str(name)
+
+
+def shard_of(name, count):
+    """Shard (0 .. count-1) of a subject; a stable hash, unlike hash() which is salted per process."""
+    digest = hashlib.md5(subject_key(name).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def in_shard(name, shard):
+    """Whether a subject belongs to `shard` ((i, N), or None for a single-node run)."""
+    return shard is None or shard_of(name, shard[1]) == shard[0]
+
+
+def partial_path(path, shard):
+    """Path of the partial output of `shard` for the final output `path`."""
+    root, ext = os.path.splitext(str(path))
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+
+def partial_paths(path, count):
+    """
+    Paths of the partial outputs of all `count` shards, in shard order.
+    Raises FileNotFoundError listing the shards that have not written their output yet.
+    """
+    paths = [partial_path(path, (i, count)) for i in range(count)]
+    missing = [i for i, p in enumerate(paths) if not os.path.isfile(p)]
+    if missing:
+        raise FileNotFoundError(f"missing partial outputs of shard(s) {missing} for {path}")
+    return paths
+
+
+def write_atomic(path, text):
+    """Write a text file under a temporary name first, then rename it into place."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def add_shard_arguments(parser):
+    """Add the mutually exclusive --shard i/N and --merge N options to an argparse parser."""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--shard', type=_shard_argument, help="process only shard i of N (0-based), e.g. 0/4")
+    group.add_argument('--merge', type=int, metavar='N', help="merge the partial outputs of N shards")
+    return parser
+
+
+def _shard_argument(text):
+    try:
+        return parse_shard(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def run_local(count, command):
+    """
+    Run `command` as `count` parallel shard processes (--shard i/count) on this machine, then once
+    with --merge count. Returns the first non-zero exit code, or 0.
+    """
+    processes = [subprocess.Popen(command + ['--shard', f"{i}/{count}"]) for i in range(count)]
+    codes = [process.wait() for process in processes]
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"Shard(s) {failed} failed; not merging.")
+        return next(code for code in codes if code != 0)
+    return subprocess.call(command + ['--merge', str(count)])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f"Usage: {sys.argv[0]} <N> <command> [arguments ...]")
+        sys.exit(1)
+    sys.exit(run_local(int(sys.argv[1]), sys.argv[2:]))
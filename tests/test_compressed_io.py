@@ -0,0 +1,122 @@
+import gzip
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+import compressed_io_commented as compressed_io
+from compressed_io_commented import iter_texts, open_binary, open_text, resolve
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'standardized_solution.txt')
+SUBJECTS = ('10000', '10001', '10002', '10003', '10004', '10005')
+
+
+@pytest.fixture
+def cohort(tmp_path):
+    """
+    The fixture output as o#####.txt files with CRLF line endings (one of them gzip compressed), in
+    a folder and in zip, tar.gz ("./" member names) and tar.bz2 archives of that folder.
+    """
+    with open(FIXTURE, 'rb') as file:
+        data = file.read().replace(b'\n', b'\r\n')
+    folder = tmp_path / 'outputs'
+    folder.mkdir()
+    for sid in SUBJECTS[1:]:
+        (folder / f"o{sid}.txt").write_bytes(data)
+    with gzip.open(folder / f"o{SUBJECTS[0]}.txt.gz", 'wb') as file:
+        file.write(data)
+
+    names = sorted(os.listdir(folder))
+    with zipfile.ZipFile(tmp_path / 'outputs.zip', 'w') as zf:
+        for name in names:
+            zf.write(folder / name, name)
+    with tarfile.open(tmp_path / 'outputs.tar.gz', 'w:gz') as tar:
+        for name in names:
+            tar.add(folder / name, arcname=f"./{name}")
+    with tarfile.open(tmp_path / 'outputs.tar.bz2', 'w:bz2') as tar:
+        for name in names:
+            tar.add(folder / name, arcname=name)
+    return tmp_path
+
+
+ARCHIVES = ('outputs.zip', 'outputs.tar.gz', 'outputs.tar.bz2')
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def expected_lines():
+    with open(FIXTURE, 'r', encoding='ISO-8859-1') as file:
+        return file.readlines()
+
+
+@pytest.mark.parametrize('archive', ARCHIVES)
+def test_archive_members_read_like_the_folder(cohort, archive):
+    for sid in SUBJECTS:
+        path = resolve(f"{cohort / archive}::o{sid}.txt")
+        with open_text(path, encoding='ISO-8859-1') as file:
+            assert file.readlines() == expected_lines()
+
+
+@pytest.mark.parametrize('archive', ARCHIVES)
+def test_missing_member_raises_file_not_found(cohort, archive):
+    with pytest.raises(FileNotFoundError):
+        open_text(f"{cohort / archive}::o99999.txt")
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason="needs /proc/self/fd")
+@pytest.mark.parametrize('archive', ARCHIVES)
+def test_closing_a_member_closes_the_archive(cohort, archive):
+    paths = [resolve(f"{cohort / archive}::o{sid}.txt") for sid in SUBJECTS]
+    before = open_fds()
+    for _ in range(20):
+        for path in paths:
+            with open_binary(path) as file:
+                file.read(10)
+    assert open_fds() == before
+
+
+def test_tar_member_is_opened_without_scanning_the_archive(cohort, monkeypatch):
+    archive = str(cohort / 'outputs.tar.gz')
+    path = resolve(f"{archive}::o10003.txt")
+
+    def scan(self):
+        raise AssertionError("the archive was scanned again")
+    monkeypatch.setattr(tarfile.TarFile, 'getmembers', scan)
+    monkeypatch.setattr(tarfile.TarFile, 'getmember', scan)
+
+    with open_text(path, encoding='ISO-8859-1') as file:
+        assert file.readlines() == expected_lines()
+
+
+@pytest.mark.parametrize('root', ('outputs',) + ARCHIVES)
+def test_iter_texts_translates_newlines(cohort, root):
+    items = list(iter_texts(cohort / root, "*.txt", encoding='ISO-8859-1'))
+    assert [compressed_io.file_name(path) for path, _ in items] == [f"o{sid}.txt" for sid in SUBJECTS]
+    for _, lines in items:
+        assert lines == expected_lines()
+
+
+@pytest.mark.parametrize('root', ('outputs',) + ARCHIVES)
+def test_iter_texts_select(cohort, root):
+    select = lambda path: compressed_io.file_name(path) in ('o10001.txt', 'o10004.txt')
+    items = list(iter_texts(cohort / root, "*.txt", encoding='ISO-8859-1', select=select))
+    assert [compressed_io.file_name(path) for path, _ in items] == ['o10001.txt', 'o10004.txt']
+
+
+@pytest.mark.parametrize('root', ('outputs',) + ARCHIVES)
+def test_iter_texts_stops_when_the_caller_stops(cohort, root):
+    before = threading.active_count()
+
+    texts = iter_texts(cohort / root, "*.txt", encoding='ISO-8859-1', prefetch=1)
+    next(texts)
+    texts.close()
+    assert threading.active_count() == before
+
+    with pytest.raises(RuntimeError):
+        for _ in iter_texts(cohort / root, "*.txt", encoding='ISO-8859-1', prefetch=1):
+            raise RuntimeError("parse error")
+    assert threading.active_count() == before
@@ -0,0 +1,195 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bulk_output_writer_commented import BulkWriter
+from convert_LISERALbeta_to_resting_commented import convert_subjects
+from edge_list_commented import (EDGE_DTYPE, EdgeListWriter, merge_edge_lists, read_edges, sort_edge_list,
+                                 subjects_path)
+from roi_registry_commented import get_registry
+
+REGISTRY = get_registry()
+N_ROIS = REGISTRY.n_rois
+
+
+def subject_beta(seed, paths=12):
+    """n x 2n beta/se/tval arrays with a few estimated paths (NaN elsewhere)."""
+    rng = np.random.default_rng(seed)
+    beta = np.full((N_ROIS, 2 * N_ROIS), np.nan)
+    cells = rng.choice(beta.size, size=paths, replace=False)
+    beta.flat[cells] = np.round(rng.uniform(-0.9, 0.9, size=paths), 2)
+    se = np.where(np.isnan(beta), np.nan, 0.05)
+    tval = beta / se
+    return beta, se, tval
+
+
+def write_cohort(path, subject_ids, seed=0, **kwargs):
+    with EdgeListWriter(path, **kwargs) as writer:
+        for i, sid in enumerate(subject_ids):
+            writer.add(sid, *subject_beta(seed + i))
+
+
+def estimates(edge_list, sid):
+    """beta matrix of one subject of an EdgeList."""
+    return edge_list.select([sid]).to_model().beta[0]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10005', '10001', '10130'])
+    edges = read_edges(path)
+    assert edges.subject_ids == ['10005', '10001', '10130']
+    assert len(edges) == 36
+    for i, sid in enumerate(edges.subject_ids):
+        np.testing.assert_array_equal(estimates(edges, sid), subject_beta(i)[0])
+
+
+def test_small_buffer_gives_the_same_file(tmp_path):
+    write_cohort(tmp_path / 'a.bin', ['10005', '10001', '10130'])
+    write_cohort(tmp_path / 'b.bin', ['10005', '10001', '10130'], buffer_edges=5)
+    assert (tmp_path / 'a.bin').read_bytes() == (tmp_path / 'b.bin').read_bytes()
+    assert (tmp_path / 'a.subjects.txt').read_text() == (tmp_path / 'b.subjects.txt').read_text()
+
+
+def test_update_replaces_in_place_and_appends_new_subjects(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10005', '10001', '10130'])
+    new_beta = subject_beta(100)
+
+    # A small buffer must not flush an update early (which would duplicate subjects)
+    with EdgeListWriter(path, update=True, buffer_edges=1) as writer:
+        writer.add('10001', *new_beta)
+        writer.add('10222', *subject_beta(101))
+
+    edges = read_edges(path)
+    assert edges.subject_ids == ['10005', '10001', '10130', '10222']
+    np.testing.assert_array_equal(estimates(edges, '10005'), subject_beta(0)[0])
+    np.testing.assert_array_equal(estimates(edges, '10001'), new_beta[0])
+    np.testing.assert_array_equal(estimates(edges, '10130'), subject_beta(2)[0])
+    np.testing.assert_array_equal(estimates(edges, '10222'), subject_beta(101)[0])
+    assert (np.diff(edges.edges['subject'].astype(int)) >= 0).all()
+    assert not [name for name in os.listdir(tmp_path) if '.tmp' in name]
+
+
+def test_update_is_idempotent(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10005', '10001'])
+    for _ in range(2):
+        with EdgeListWriter(path, update=True) as writer:
+            writer.add('10001', *subject_beta(100))
+        data, ids = path.read_bytes(), (tmp_path / 'cohort_edges.subjects.txt').read_text()
+    assert ids == "10005\n10001\n"
+    with EdgeListWriter(path, update=True) as writer:
+        writer.add('10001', *subject_beta(100))
+    assert path.read_bytes() == data
+
+
+def test_update_creates_a_missing_edge_list(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    with EdgeListWriter(path, update=True) as writer:
+        writer.add('10005', *subject_beta(0))
+    assert read_edges(path).subject_ids == ['10005']
+
+
+def test_unlisted_records_are_ignored(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10005', '10001'])
+    # Records of a third subject whose ID was never written (an interrupted flush)
+    stray = np.zeros(3, dtype=EDGE_DTYPE)
+    stray['subject'] = 2
+    with open(path, 'ab') as file:
+        stray.tofile(file)
+    assert read_edges(path).subject_ids == ['10005', '10001']
+    assert len(read_edges(path)) == 24
+
+    # Appending drops them before adding new subjects
+    write_cohort(path, ['10130'], seed=2, append=True)
+    edges = read_edges(path)
+    assert edges.subject_ids == ['10005', '10001', '10130']
+    np.testing.assert_array_equal(estimates(edges, '10130'), subject_beta(2)[0])
+
+
+@pytest.mark.parametrize('shards', ([['10222', '10005'], ['10130'], ['10011']],
+                                    [['10011', '10130', '10222'], [], ['10005']]))
+def test_merge_equals_a_sorted_single_list(tmp_path, shards):
+    seeds = {'10222': 0, '10005': 1, '10130': 2, '10011': 3}
+    single = tmp_path / 'single.bin'
+    with EdgeListWriter(single) as writer:
+        for sid in ('10222', '10005', '10130', '10011'):
+            writer.add(sid, *subject_beta(seeds[sid]))
+    sort_edge_list(single)
+
+    partials = []
+    for i, shard in enumerate(shards):
+        partial = tmp_path / f"partial-{i}.bin"
+        with EdgeListWriter(partial) as writer:
+            for sid in shard:
+                writer.add(sid, *subject_beta(seeds[sid]))
+        partials.append(partial)
+    merged = tmp_path / 'merged.bin'
+    assert merge_edge_lists(partials, merged) == 4
+
+    assert read_edges(merged).subject_ids == ['10005', '10011', '10130', '10222']
+    assert merged.read_bytes() == single.read_bytes()
+    assert open(subjects_path(merged)).read() == open(subjects_path(single)).read()
+
+
+def test_sort_leaves_a_sorted_list_untouched(tmp_path):
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10001', '10005'])
+    os.utime(path, (0, 0))
+    sort_edge_list(path)
+    assert os.path.getmtime(path) == 0
+
+
+@pytest.fixture
+def extracted(tmp_path):
+    """An extracted folder with the beta csv files of three subjects, and their edge list written after them."""
+    path = tmp_path / 'cohort_edges.bin'
+    write_cohort(path, ['10001', '10005', '10130'])
+    edges = read_edges(path)
+    with BulkWriter() as writer:
+        edges.to_model().write_beta_csv(str(tmp_path), writer)
+    os.utime(path)
+    return tmp_path
+
+
+def convert(folder):
+    group = np.zeros((N_ROIS, 2 * N_ROIS), dtype=bool)
+    id_to_complex = {sid: f"csm14aff{sid}_1" for sid in ('10001', '10005', '10130')}
+    beta_df, processed_ids = convert_subjects(str(folder), group, id_to_complex)
+    return beta_df, sorted(processed_ids)
+
+
+def test_converter_reads_a_fresh_edge_list(extracted, capsys):
+    from_edges = convert(extracted)
+    assert "Reading the cohort edge list" in capsys.readouterr().out
+
+    os.remove(extracted / 'cohort_edges.bin')
+    from_beta_files = convert(extracted)
+    pd.testing.assert_frame_equal(from_edges[0], from_beta_files[0])
+    assert from_edges[1] == from_beta_files[1] == ['10001', '10005', '10130']
+
+
+def test_converter_skips_an_edge_list_older_than_a_beta_file(extracted, capsys):
+    # Rewrite the beta file of one subject after the edge list
+    beta_path = extracted / '10005' / '10005_beta.csv'
+    df = pd.read_csv(beta_path, index_col=0)
+    df[df != 0] = 0.5
+    df.to_csv(beta_path)
+    stamp = os.path.getmtime(extracted / 'cohort_edges.bin') + 10
+    os.utime(beta_path, (stamp, stamp))
+
+    beta_df, _ = convert(extracted)
+    assert "some beta files are newer than" in capsys.readouterr().out
+    assert (beta_df.loc[beta_df['file'] == 'csm14aff10005_1', 'beta'] == 0.5).all()
+
+
+def test_converter_skips_an_edge_list_of_other_subjects(extracted, capsys):
+    os.remove(extracted / '10130' / '10130_beta.csv')
+    beta_df, processed_ids = convert(extracted)
+    assert "differ from the subject folders" in capsys.readouterr().out
+    assert processed_ids == ['10001', '10005']
+    assert set(beta_df['file']) == {'csm14aff10001_1', 'csm14aff10005_1'}
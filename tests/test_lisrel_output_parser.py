@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from lisrel_output_parser_commented import extract_model
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'standardized_solution.txt')
+N_VARS = 4
+
+
+@pytest.fixture
+def lines():
+    with open(FIXTURE, 'r', encoding='ISO-8859-1') as file:
+        return file.readlines()
+
+
+def model_start(lines):
+    return next(i for i, line in enumerate(lines) if "LISREL Estimates (Maximum Likelihood)" in line)
+
+
+def test_standardized_solutions_do_not_overwrite_estimates(lines):
+    results, _ = extract_model(lines, model_start(lines), n_vars=N_VARS)
+
+    beta = results['BETA']
+    assert beta.estimate[2, 0] == 0.40
+    assert beta.estimate[2, 3] == 0.25
+    assert beta.estimate[3, 1] == 0.30
+    assert beta.se[2, 3] == 0.10
+    assert beta.tval[3, 1] == 5.00
+    assert np.isnan(beta.estimate[:2]).all()
+
+    psi = results['PSI']
+    assert psi.estimate.shape == (N_VARS, N_VARS)
+    np.testing.assert_array_equal(np.diag(psi.estimate), [0.90, 0.80, 0.70, 0.60])
+    np.testing.assert_array_equal(np.diag(psi.se), [0.09, 0.08, 0.07, 0.06])
+
+    smc = results['Squared Multiple Correlations for Structural Equations']
+    np.testing.assert_array_equal(smc.estimate, [[0.10, 0.20, 0.30, 0.40]])
+
+
+def test_fit_statistics_read_the_value_after_equals(lines):
+    _, fit = extract_model(lines, model_start(lines), n_vars=N_VARS)
+
+    assert fit == {'df': 12.0, 'chi_square': 612.34, 'chi_square_p': 0.00045, 'rmsea': 0.031,
+                   'nnfi': 0.96, 'cfi': 0.97, 'srmr': 0.042}
+
+
+def test_missing_matrix_is_left_out(lines):
+    start = model_start(lines)
+    psi_start = next(i for i in range(start, len(lines)) if lines[i].strip() == 'PSI')
+    smc_start = next(i for i in range(psi_start, len(lines)) if 'Squared Multiple Correlations' in lines[i])
+    without_psi = lines[:psi_start] + lines[smc_start:]
+
+    results, _ = extract_model(without_psi, start, n_vars=N_VARS)
+
+    assert 'PSI' not in results
+    assert set(results) == {'BETA', 'Squared Multiple Correlations for Structural Equations'}
+
+
+def test_no_model_gives_no_matrices():
+    assert extract_model([], None, n_vars=N_VARS) == ({}, {})
+
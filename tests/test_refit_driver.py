@@ -0,0 +1,144 @@
+import os
+import shlex
+import sys
+
+import numpy as np
+import pytest
+
+import refit_driver_commented as refit_driver
+from bulk_output_writer_commented import BulkWriter
+from edge_list_commented import read_edges
+from roi_registry_commented import get_registry
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'standardized_solution.txt')
+N_ROIS = get_registry().n_rois
+
+# Stands in for LISERAL: records the subject, then fails for the sids listed in FAIL_SIDS or
+# writes the fixture output
+FAKE_LISREL = """\
+import os, shutil, sys
+sid, output, log = sys.argv[1:4]
+with open(log, 'a') as file:
+    file.write(sid + "\\n")
+if sid in os.environ.get('FAIL_SIDS', '').split(','):
+    sys.exit(3)
+shutil.copy({fixture!r}, output)
+"""
+
+
+@pytest.fixture
+def refit(tmp_path, monkeypatch):
+    """
+    A QC table of five subjects: 10001 and 10002 flagged with paths, 10003 not flagged, 10004
+    flagged without a path file (but with an input matrix left from a previous prepare) and 10005
+    flagged with an empty path file.
+    """
+    (tmp_path / 'bad_subIDs.csv').write_text(
+        "sub_id,bad_psi,bad_beta\n"
+        "csm14aff10001_1,True,False\n"
+        "csm14aff10002_1,False,True\n"
+        "csm14aff10003_1,False,False\n"
+        "csm14aff10004_1,True,True\n"
+        "csm14aff10005_1,True,False\n")
+    paths = tmp_path / 'paths'
+    paths.mkdir()
+    (paths / 'csm14aff10001_1_paths.txt').write_text("DMN_2 ~ DMN_1lag\nSAL_1 ~ DMN_2\n")
+    (paths / 'csm14aff10002_1_paths.txt').write_text("FPN_6 ~ SAL_3\n")
+    (paths / 'csm14aff10005_1_paths.txt').write_text("")
+    (tmp_path / 'input').mkdir()
+    (tmp_path / 'input' / '10004_matrix.txt').write_text("old matrix\n")
+    for folder in ('output', 'extracted'):
+        (tmp_path / folder).mkdir()
+    (tmp_path / 'fake_lisrel.py').write_text(FAKE_LISREL.format(fixture=FIXTURE))
+
+    monkeypatch.setattr(refit_driver, 'PATHS_TEMPLATE', str(paths / '{sub_id}_paths.txt'))
+    monkeypatch.setattr(refit_driver, 'INPUT_MATRIX_TEMPLATE', str(tmp_path / 'input' / '{sid}_matrix.txt'))
+    monkeypatch.setattr(refit_driver, 'WORKERS', 2)
+    monkeypatch.delenv('FAIL_SIDS', raising=False)
+    return tmp_path
+
+
+def run_all(folder):
+    command = f"{shlex.quote(sys.executable)} {shlex.quote(str(folder / 'fake_lisrel.py'))} {{sid}} {{output}} " \
+              f"{shlex.quote(str(folder / 'runs.log'))}"
+    return refit_driver.main(['all', str(folder / 'bad_subIDs.csv'), str(folder / 'output'),
+                              str(folder / 'extracted'), '--lisrel-cmd', command])
+
+
+def runs(folder):
+    log = folder / 'runs.log'
+    return sorted(log.read_text().split()) if log.exists() else []
+
+
+def test_flagged_subjects(refit):
+    qc = refit_driver.flagged_subjects(str(refit / 'bad_subIDs.csv'))
+    assert list(qc['sid']) == ['10001', '10002', '10004', '10005']
+
+
+def test_prepare_returns_the_written_subjects(refit, capsys):
+    qc = refit_driver.flagged_subjects(str(refit / 'bad_subIDs.csv'))
+    with BulkWriter() as writer:
+        prepared = refit_driver.prepare(qc, writer)
+    assert prepared == ['10001', '10002', '10005']
+    out = capsys.readouterr().out
+    assert "missing path file for 10004" in out
+    assert "no 'lhs ~ rhs' paths" in out and "for 10005" in out
+
+    lag_diagonal = np.zeros((N_ROIS, 2 * N_ROIS), dtype=int)
+    lag_diagonal[np.arange(N_ROIS), np.arange(N_ROIS)] = 1
+    np.testing.assert_array_equal(np.loadtxt(refit / 'input' / '10005_matrix.txt', dtype=int), lag_diagonal)
+
+    expected = lag_diagonal.copy()
+    expected[1, 0] = 1              # DMN_2 ~ DMN_1lag
+    expected[6, N_ROIS + 1] = 1     # SAL_1 ~ DMN_2
+    np.testing.assert_array_equal(np.loadtxt(refit / 'input' / '10001_matrix.txt', dtype=int), expected)
+    assert (refit / 'input' / '10004_matrix.txt').read_text() == "old matrix\n"
+
+
+def test_all_runs_and_extracts_only_the_prepared_subjects(refit):
+    assert run_all(refit) == 0
+    assert runs(refit) == ['10001', '10002', '10005']
+    assert not (refit / 'output' / 'o10004.txt').exists()
+    assert sorted(read_edges(refit / 'extracted' / 'cohort_edges.bin').subject_ids) == ['10001', '10002', '10005']
+    for sid in ('10001', '10002', '10005'):
+        assert (refit / 'extracted' / sid / f"{sid}_beta.csv").exists()
+    assert not (refit / 'extracted' / '10004').exists()
+
+
+def test_all_leaves_failed_runs_out_of_the_extract(refit, monkeypatch):
+    monkeypatch.setenv('FAIL_SIDS', '10002')
+    assert run_all(refit) == 0
+    assert runs(refit) == ['10001', '10002', '10005']
+    assert sorted(read_edges(refit / 'extracted' / 'cohort_edges.bin').subject_ids) == ['10001', '10005']
+    assert not (refit / 'extracted' / '10002').exists()
+
+
+def test_all_fails_when_every_run_fails(refit, monkeypatch, capsys):
+    monkeypatch.setenv('FAIL_SIDS', '10001,10002,10005')
+    assert run_all(refit) == 1
+    assert "LISERAL failed for every subject" in capsys.readouterr().out
+    assert not (refit / 'extracted' / 'cohort_edges.bin').exists()
+
+
+def test_all_fails_when_nothing_was_prepared(refit, capsys):
+    for path in (refit / 'paths').iterdir():
+        path.unlink()
+    assert run_all(refit) == 1
+    assert "No LISERAL input matrices were written" in capsys.readouterr().out
+    assert runs(refit) == []
+
+
+def test_extract_skips_outputs_older_than_their_input_matrix(refit, capsys):
+    qc = refit_driver.flagged_subjects(str(refit / 'bad_subIDs.csv'))
+    for sid in ('10001', '10004'):
+        output = refit / 'output' / f"o{sid}.txt"
+        output.write_bytes(open(FIXTURE, 'rb').read())
+        os.utime(output, (0, 0))
+    (refit / 'input' / '10001_matrix.txt').write_text("new matrix\n")
+    os.utime(refit / 'input' / '10004_matrix.txt', (0, 0))
+
+    with BulkWriter() as writer:
+        assert refit_driver.extract(qc, str(refit / 'output'), str(refit / 'extracted'), writer) == 1
+    out = capsys.readouterr().out
+    assert "output for 10001 is older than its input matrix" in out
+    assert read_edges(refit / 'extracted' / 'cohort_edges.bin').subject_ids == ['10004']
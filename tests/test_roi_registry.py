@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from gimme_model_commented import GimmeModel
+from roi_registry_commented import ROIRegistry, get_registry
+
+# Two networks of two ROIs: lag codes 0..3 (VAR 1..4), contemporaneous codes 4..7 (VAR 5..8)
+REGISTRY = ROIRegistry(['DMN', 'DMN', 'SAL', 'SAL'], ['DMN_1', 'DMN_2', 'SAL_1', 'SAL_2'])
+
+
+def test_label_codes_follow_the_var_numbers():
+    assert list(REGISTRY.labels) == ['DMN_1lag', 'DMN_2lag', 'SAL_1lag', 'SAL_2lag', 'DMN_1', 'DMN_2', 'SAL_1', 'SAL_2']
+    assert list(REGISTRY.encode(['DMN_1lag', ' SAL_2 ', 'DMN_2'])) == [0, 7, 5]
+    assert list(REGISTRY.encode_vars(['VAR 1', 'VAR8', 'VAR 5'])) == [0, 7, 4]
+    assert list(REGISTRY.network_names) == ['DMN', 'SAL']
+
+
+def test_encode_rejects_unknown_labels():
+    with pytest.raises(KeyError, match='FPN_1'):
+        REGISTRY.encode(['DMN_1', 'FPN_1'])
+
+
+def test_encode_lhs_gives_roi_rows():
+    assert list(REGISTRY.encode_lhs(['DMN_1', 'SAL_2', 'DMN_2'])) == [0, 3, 1]
+
+
+def test_encode_lhs_rejects_lagged_labels():
+    with pytest.raises(KeyError, match='SAL_1lag'):
+        REGISTRY.encode_lhs(['DMN_1', 'SAL_1lag'])
+    with pytest.raises(KeyError, match='unknown'):
+        REGISTRY.encode_lhs(['FPN_1'])
+
+
+def test_adjacency_layout():
+    mask = REGISTRY.adjacency(['SAL_1', 'DMN_2', 'SAL_1'], ['DMN_1lag', 'SAL_2', 'SAL_1lag'])
+    expected = np.zeros((4, 8), dtype=np.int8)
+    expected[2, 0] = 1      # SAL_1 ~ DMN_1lag
+    expected[1, 7] = 1      # DMN_2 ~ SAL_2
+    expected[2, 2] = 1      # SAL_1 ~ SAL_1lag
+    np.testing.assert_array_equal(mask, expected)
+    assert mask.dtype == np.int8
+
+
+def test_adjacency_lag_diagonal():
+    mask = REGISTRY.adjacency(['DMN_2'], ['SAL_2'], lag_diagonal=True)
+    expected = np.zeros((4, 8), dtype=np.int8)
+    expected[np.arange(4), np.arange(4)] = 1
+    expected[1, 7] = 1
+    np.testing.assert_array_equal(mask, expected)
+    np.testing.assert_array_equal(REGISTRY.adjacency([], [], lag_diagonal=True)[:, :4], np.eye(4, dtype=np.int8))
+
+
+def test_adjacency_rejects_a_lagged_lhs():
+    with pytest.raises(KeyError, match='lagged'):
+        REGISTRY.adjacency(['DMN_1lag'], ['SAL_2'])
+
+
+def test_from_r_frame_rejects_a_lagged_lhs():
+    df = pd.DataFrame({'file': ['10005', '10005'], 'lhs': ['DMN_1', 'DMN_2lag'], 'rhs': ['SAL_1', 'SAL_1'],
+                       'beta': [0.2, 0.3], 'level': ['ind', 'ind']})
+    with pytest.raises(KeyError, match='DMN_2lag'):
+        GimmeModel.from_r_frame(df, registry=REGISTRY)
+
+
+def test_default_layout():
+    registry = get_registry()
+    assert registry is get_registry()
+    assert registry.n_rois == 18 and registry.n_vars == 36
+    assert registry.labels[0] == 'DMN_1lag' and registry.labels[18] == 'DMN_1' and registry.labels[-1] == 'FPN_6'
@@ -0,0 +1,116 @@
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+import liseral_AM_extract_commented as am_extract
+import search_indSEM_betapsi_commented as indsem_search
+from sharding_commented import in_shard, parse_shard, partial_path, partial_paths, shard_of, subject_key
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'standardized_solution.txt')
+SHARDS = 3
+
+
+@pytest.mark.parametrize('text, expected', [('0/4', (0, 4)), (' 3 / 4 ', (3, 4)), ('0/1', (0, 1))])
+def test_parse_shard(text, expected):
+    assert parse_shard(text) == expected
+
+
+@pytest.mark.parametrize('text', ['4/4', '1/0', '-1/4', '1', 'a/b', ''])
+def test_parse_shard_rejects_invalid_specifications(text):
+    with pytest.raises(ValueError):
+        parse_shard(text)
+
+
+def test_shards_partition_the_subjects():
+    names = [f"o{10000 + i}.txt" for i in range(200)]
+    for count in (1, 2, 3, 7):
+        shards = [[name for name in names if in_shard(name, (i, count))] for i in range(count)]
+        assert sorted(sum(shards, [])) == names
+        assert all(shards) or count > len(names)
+
+
+def test_shard_follows_the_participant_id():
+    assert subject_key("csm14aff10005_1Betas.csv") == '10005'
+    assert subject_key("pilot") == 'pilot'
+    assert shard_of("o10005.txt", 4) == shard_of("10005", 4) == shard_of("csm14aff10005_1", 4)
+
+
+def test_partial_paths(tmp_path):
+    path = tmp_path / 'GIMME_r_format_output.csv'
+    assert partial_path(path, (1, 4)) == str(tmp_path / 'GIMME_r_format_output.shard-1-of-4.csv')
+    open(partial_path(path, (0, 2)), 'w').close()
+    with pytest.raises(FileNotFoundError, match=r"\[1\]"):
+        partial_paths(path, 2)
+
+
+def read_outputs(folder, names):
+    return {name: (Path(folder) / name).read_bytes() for name in names}
+
+
+@pytest.fixture
+def lisrel_archive(tmp_path):
+    """The fixture output for four subjects in a tar archive, not in ID order (as a tar is read)."""
+    archive = tmp_path / 'outputs.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        for sid in ('10222', '10005', '10130', '10011'):
+            tar.add(FIXTURE, arcname=f"o{sid}.txt")
+    return archive
+
+
+def test_am_extract_merge_equals_a_single_node_run(tmp_path, monkeypatch, lisrel_archive):
+    monkeypatch.setattr(am_extract, 'folder_path', str(lisrel_archive))
+    names = [am_extract.COHORT_FIT_FILENAME, am_extract.EDGE_LIST_FILENAME, 'cohort_edges.subjects.txt']
+
+    monkeypatch.setattr(am_extract, 'save_path', str(tmp_path / 'single'))
+    am_extract.main([])
+    single = read_outputs(tmp_path / 'single', names)
+    assert single['cohort_edges.subjects.txt'] == b"10005\n10011\n10130\n10222\n"
+
+    monkeypatch.setattr(am_extract, 'save_path', str(tmp_path / 'sharded'))
+    for i in range(SHARDS):
+        am_extract.main(['--shard', f"{i}/{SHARDS}"])
+    am_extract.main(['--merge', str(SHARDS)])
+    assert read_outputs(tmp_path / 'sharded', names) == single
+
+    for sid in ('10005', '10011', '10130', '10222'):
+        assert read_outputs(tmp_path / 'sharded' / sid, [f"{sid}_beta.csv"]) == \
+            read_outputs(tmp_path / 'single' / sid, [f"{sid}_beta.csv"])
+
+
+def write_indsem_subject(root, sub_id, beta_value, psi_value):
+    folder = root / sub_id / 'individual'
+    folder.mkdir(parents=True)
+    (folder / f"{sub_id}Betas.csv").write_text(f"lhs,A_lag,B\nA,3.5,{beta_value}\nB,0.1,0.2\n")
+    (folder / f"{sub_id}Psi.csv").write_text(f"row,A,B\nA,{psi_value},0.1\nB,0.1,0.4\n")
+
+
+def test_indsem_search_merge_equals_a_single_node_run(tmp_path, monkeypatch):
+    root = tmp_path / 'output_indSEM_folder'
+    write_indsem_subject(root, 'csm14aff10001_1', 0.3, 0.5)
+    write_indsem_subject(root, 'csm14aff10002_1', 1.7, 0.5)
+    write_indsem_subject(root, 'csm14aff10003_1', 0.3, -1.2)
+    write_indsem_subject(root, 'csm14aff10004_1', -2.0, 1.5)
+    (root / 'csm14aff10005_1' / 'individual').mkdir(parents=True)
+    monkeypatch.setattr(indsem_search, 'folder_path', root)
+    names = [indsem_search.BAD_SUBIDS_FILENAME, indsem_search.DETAILS_FILENAME, indsem_search.MISSING_FILENAME]
+
+    for name in ('single', 'sharded'):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(indsem_search, 'save_path', tmp_path / 'single')
+    indsem_search.main([])
+    single = read_outputs(tmp_path / 'single', names)
+    assert single[indsem_search.BAD_SUBIDS_FILENAME].decode().splitlines() == [
+        'sub_id,bad_psi,bad_beta',
+        'csm14aff10002_1,False,True',
+        'csm14aff10003_1,True,False',
+        'csm14aff10004_1,True,True',
+    ]
+    assert single[indsem_search.MISSING_FILENAME] == b"csm14aff10005_1\n"
+
+    monkeypatch.setattr(indsem_search, 'save_path', tmp_path / 'sharded')
+    for i in range(SHARDS):
+        indsem_search.main(['--shard', f"{i}/{SHARDS}"])
+    indsem_search.main(['--merge', str(SHARDS)])
+    assert read_outputs(tmp_path / 'sharded', names) == single